@@ -0,0 +1,60 @@
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from circuits import *
+
+
+# Runs a queue of independent encrypted programs under one cloud keyset on a
+# pool of worker processes. Each worker imports the cloud keyset once and
+# keeps it for every job it runs. A job is (rom, cycles, output): the name
+# of a container of encrypted code (see export_code), the number of cycles
+# to run it for, and the name of the container to write its final RAM to.
+
+cloud = None
+
+
+def initialize_worker(cloud_keyset_path):
+    global cloud
+    cloud = import_cloud_keyset(cloud_keyset_path.encode())
+    TRUE.eval(cloud)
+    FALSE.eval(cloud)
+
+
+def run_job(job):
+    rom, cycles, output = job
+    code = import_code(rom)
+    if code is None:
+        raise FileNotFoundError(rom)
+    start = time.perf_counter()
+    with Computer(code) as computer:
+        computer.init(cloud)
+        computer.run(cloud, cycles)
+        seconds = time.perf_counter() - start
+        export_code(output, computer.data)
+        bootstraps = computer.netlist.bootstraps()
+    delete_bus([bit for bus in code for bit in bus])
+    return {
+        "rom": rom,
+        "output": output,
+        "cycles": cycles,
+        "seconds": seconds,
+        "hertz": cycles / seconds,
+        "bootstraps_per_second": bootstraps * cycles / seconds,
+    }
+
+
+# Yields the report of every job in the order the jobs were given
+def run_batch(jobs, cloud_keyset_path, processes=None):
+    with ProcessPoolExecutor(processes, initializer=initialize_worker, initargs=(cloud_keyset_path,)) as pool:
+        yield from pool.map(run_job, jobs)
+
+
+# python batch.py <cloud keyset> <rom>:<cycles> ...
+# writes the final RAM of every <rom> to <rom>.ram
+if __name__ == "__main__":
+    jobs = []
+    for argument in sys.argv[2:]:
+        rom, cycles = argument.rsplit(":", 1)
+        jobs.append((rom, int(cycles), rom + ".ram"))
+    for report in run_batch(jobs, sys.argv[1]):
+        print("%(rom)s: %(cycles)d cycles in %(seconds).1fs, %(hertz).3f Hz, %(bootstraps_per_second).0f bootstraps/s" % report)
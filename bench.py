@@ -0,0 +1,140 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from argparse import SUPPRESS, ArgumentParser
+
+
+# Benchmarks Computer over every combination of program, RAM width and
+# word size, each in a fresh process so that its peak memory is its own.
+# By default it runs on the plaintext backend, which evaluates the same
+# netlist and so counts the same gates; pass --library to run on TFHE.
+#
+#   python bench.py --output results.json
+#   python bench.py --baseline results.json
+#
+# With a baseline, it exits with an error if any configuration now needs
+# more gates or bootstraps per cycle, or runs slower than --tolerance allows.
+
+CORPUS = {
+    "clear": "+++++[-]",
+    "move": ">>+<<+>-",
+    "add": "++>+++[<+>-]",
+    "multiply": "+++[>++<-]",
+    "nested": "++[>++[>+<-]<-]",
+    "scan": "+>+>+>+[<]>[>]",
+}
+
+COUNTS = ["gates_per_cycle", "bootstraps_per_cycle", "levels", "critical_path"]
+TIMES = ["construction_seconds", "seconds_per_cycle"]
+
+
+def measure(config):
+    os.environ["TFHE_LIBRARY"] = config["library"]
+    import resource
+    import circuits
+    from cache import load_secret_keyset
+
+    secret = load_secret_keyset(circuits.GATE_PARAMS)
+    cloud = circuits.get_cloud_keyset(secret)
+    circuits.TRUE.eval(cloud)
+    circuits.FALSE.eval(cloud)
+    code = circuits.compile_code(CORPUS[config["program"]], secret)
+
+    # Without the netlist cache, so construction_seconds always times a full build
+    start = time.perf_counter()
+    computer = circuits.Computer(code, workers=config["workers"], ram_width=config["ram_width"],
+                                 word_bits=config["architecture"], cache=None)
+    construction = time.perf_counter() - start
+    computer.init(cloud)
+    start = time.perf_counter()
+    computer.run(cloud, config["cycles"])
+    seconds = (time.perf_counter() - start) / config["cycles"]
+
+    netlist = computer.netlist
+    return dict(config, **{
+        "rom_length": len(code),
+        "gates_per_cycle": len(netlist.gates),
+        "bootstraps_per_cycle": netlist.bootstraps(),
+        "levels": netlist.depth(),
+        "critical_path": netlist.critical_path()[0],
+        "construction_seconds": construction,
+        "seconds_per_cycle": seconds,
+        "cycles_per_second": 1 / seconds,
+        "bootstraps_per_second": netlist.bootstraps() / seconds,
+        # kilobytes on Linux, bytes on macOS
+        "peak_memory": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    })
+
+
+def key(result):
+    return "%(program)s/ram%(ram_width)d/arch%(architecture)d/%(library)s" % result
+
+
+# The gate counts don't depend on the workers or the number of cycles, but
+# the times do, so they are only compared between runs that used the same.
+def compare(results, baseline, tolerance):
+    previous = {key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        if key(result) not in previous:
+            continue
+        old = previous[key(result)]
+        for metric in COUNTS:
+            if result[metric] > old[metric]:
+                regressions.append("%s: %s went from %d to %d" % (key(result), metric, old[metric], result[metric]))
+        if (old["workers"], old["cycles"]) != (result["workers"], result["cycles"]):
+            continue
+        for metric in TIMES:
+            if result[metric] > old[metric] * (1 + tolerance):
+                regressions.append("%s: %s went from %.3g to %.3g" % (key(result), metric, old[metric], result[metric]))
+    return regressions
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--programs", nargs="+", default=sorted(CORPUS), choices=sorted(CORPUS))
+    parser.add_argument("--ram-widths", nargs="+", type=int, default=[4, 8, 16])
+    parser.add_argument("--architectures", nargs="+", type=int, default=[8])
+    parser.add_argument("--library", default="plaintext")
+    parser.add_argument("--cycles", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--measure", help=SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.measure:
+        print(json.dumps(measure(json.loads(arguments.measure))))
+        return
+
+    results = []
+    for program in arguments.programs:
+        for ram_width in arguments.ram_widths:
+            for architecture in arguments.architectures:
+                config = {"program": program, "ram_width": ram_width, "architecture": architecture,
+                          "library": arguments.library, "cycles": arguments.cycles, "workers": arguments.workers}
+                output = subprocess.run([sys.executable, __file__, "--measure", json.dumps(config)],
+                                        check=True, stdout=subprocess.PIPE).stdout
+                result = json.loads(output.splitlines()[-1])
+                results.append(result)
+                print("%-32s %6d gates %6d bootstraps %8.3f Hz %10.0f bootstraps/s %7.2fs to build" % (
+                    key(result), result["gates_per_cycle"], result["bootstraps_per_cycle"],
+                    result["cycles_per_second"], result["bootstraps_per_second"], result["construction_seconds"]))
+
+    if arguments.output:
+        with open(arguments.output, "w") as file:
+            json.dump(results, file, indent=2)
+    if arguments.baseline:
+        with open(arguments.baseline) as file:
+            regressions = compare(results, json.load(file), arguments.tolerance)
+        for regression in regressions:
+            print("regression:", regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
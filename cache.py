@@ -0,0 +1,123 @@
+import hashlib
+import json
+import tempfile
+from tfhe import *
+
+
+# An opt-in on-disk cache, enabled by setting TFHE_CACHE to a directory.
+# Every file in it has a .sha256 file next to it with its digest, and is
+# only used if that still matches. Anything that doesn't is rebuilt.
+# The cache holds secret keysets, so keep it somewhere private.
+
+TFHE_CACHE = os.environ.get("TFHE_CACHE")
+
+
+def digest_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_path(cache, name):
+    os.makedirs(cache, mode=0o700, exist_ok=True)
+    return os.path.join(cache, name)
+
+
+def is_cached(path):
+    try:
+        with open(path + ".sha256") as file:
+            return file.read().strip() == digest_file(path)
+    except OSError:
+        return False
+
+
+# `write` writes the file to the path it is given, which is then moved
+# into place along with its digest. Every call writes to a temporary file
+# of its own, so processes that store the same file at once don't trip
+# over each other.
+def store(path, write):
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".")
+    os.close(descriptor)
+    try:
+        write(temporary)
+        os.chmod(temporary, 0o600)
+        with open(temporary + ".sha256", "w") as file:
+            file.write(digest_file(temporary))
+        os.replace(temporary, path)
+        os.replace(temporary + ".sha256", path + ".sha256")
+    finally:
+        for leftover in [temporary, temporary + ".sha256"]:
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+# Keysets are keyed by the library and the serialized parameter set,
+# so keys for different parameters never get mixed up.
+def get_params_key(gate_params):
+    digest = hashlib.sha256(TFHE_LIBRARY.encode())
+    digest.update(export_gate_params_to_buffer(gate_params))
+    return digest.hexdigest()[:32]
+
+
+def load_secret_keyset(gate_params, cache=TFHE_CACHE):
+    if cache is None:
+        return create_secret_keyset(gate_params)
+    key = get_params_key(gate_params)
+    path = cache_path(cache, key + ".secret")
+    if is_cached(path):
+        return import_secret_keyset(path.encode())
+    secret_keyset = create_secret_keyset(gate_params)
+    store(path, lambda temporary: export_secret_keyset(temporary.encode(), secret_keyset))
+    store(cache_path(cache, key + ".cloud"), lambda temporary: export_cloud_keyset(temporary.encode(), get_cloud_keyset(secret_keyset)))
+    return secret_keyset
+
+
+# For servers, which only ever need the cloud keyset
+def load_cloud_keyset(gate_params, cache=TFHE_CACHE):
+    if cache is None:
+        raise ValueError("set TFHE_CACHE to load a cached cloud keyset")
+    path = cache_path(cache, get_params_key(gate_params) + ".cloud")
+    if not is_cached(path):
+        raise FileNotFoundError("no cloud keyset for these parameters in " + cache)
+    return import_cloud_keyset(path.encode())
+
+
+# Netlists of Computers are keyed by every parameter that their topology
+# depends on (see Computer), which have to be JSON.
+def get_netlist_path(cache, parameters):
+    digest = hashlib.sha256(json.dumps(parameters, sort_keys=True).encode())
+    return cache_path(cache, digest.hexdigest()[:32] + ".netlist")
+
+
+# Returns None if there is no such netlist in the cache, or it can't be read
+def load_netlist(parameters, cache=TFHE_CACHE):
+    if cache is None:
+        return None
+    try:
+        path = get_netlist_path(cache, parameters)
+        if not is_cached(path):
+            return None
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+# Returns the netlist to use: the one in the cache if another process
+# stored it first, and otherwise the one that was given, even if it
+# couldn't be stored. The cache never keeps a Computer from being built.
+def store_netlist(parameters, description, cache):
+    def write(temporary):
+        with open(temporary, "w") as file:
+            json.dump(description, file)
+
+    stored = load_netlist(parameters, cache)
+    if stored is not None:
+        return stored
+    try:
+        store(get_netlist_path(cache, parameters), write)
+    except OSError:
+        pass
+    return description
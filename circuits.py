@@ -1,34 +1,118 @@
-from abc import ABC, abstractmethod
+import sys
+from abc import ABC, ABCMeta, abstractmethod
+from contextlib import contextmanager
 from tfhe import *
+from netlist import *
+from container import *
+from shared import *
+from profiler import *
+from native import *
+from cache import *
 
 RAM_WIDTH = 16
+ARENA_BLOCK = 1024
 GATE_PARAMS = create_gate_params(MINIMUM_LAMBDA)
+# Cached netlists are keyed by the source of the modules that build them,
+# so they are rebuilt whenever the circuits or the netlist passes change
+SOURCES = [digest_file(path) for path in [__file__, sys.modules[Netlist.__module__].__file__]]
 
 
-def encode(value):
-    modulo = value % 2 ** (ARCHITECTURE - 1)
-    binary = bin(modulo)[2:].zfill(ARCHITECTURE - 1)
-    string = "1" + binary if value < 0 else "0" + binary
-    return [bool(int(char)) for char in string]
+# Two's complement, most significant bit first. Values outside of the
+# signed range wrap around, so encode(i, bits) is also the unsigned index i.
+def encode(value, bits=ARCHITECTURE):
+    value %= 2 ** bits
+    return [bool(value >> i & 1) for i in reversed(range(bits))]
 
 
+# Works on bools as well as on arrays of bits with one bit per lane
 def decode(bits):
-    value = int("".join(map(str, map(int, bits[1:]))), 2)
-    return value - 2 ** (ARCHITECTURE - 1) if bits[0] else value
+    value = 0
+    for bit in bits[1:]:
+        value = value * 2 + bit
+    return value - 2 ** (len(bits) - 1) * bits[0]
 
 
-def create_bus():
-    bus = []
-    for i in range(ARCHITECTURE):
-        bus.append(create_ciphertext(GATE_PARAMS))
-    return bus
+# encode and decode for many words at once with NumPy, with a row of bits
+# for every word. NumPy is only needed for these.
+def encode_words(values, bits=ARCHITECTURE):
+    import numpy
+    values = numpy.asarray(values, dtype=numpy.int64) % 2 ** bits
+    return (values[..., None] >> numpy.arange(bits - 1, -1, -1) & 1).astype(bool)
 
 
-def create_ram():
-    ram = []
-    for i in range(RAM_WIDTH):
-        ram.append(create_bus())
-    return ram
+def decode_words(bits):
+    import numpy
+    bits = numpy.asarray(bits, dtype=numpy.int64)
+    weights = 2 ** numpy.arange(bits.shape[-1] - 1, -1, -1)
+    weights[0] = -weights[0]
+    return bits @ weights
+
+
+# An Arena allocates ciphertexts in contiguous blocks and frees them all
+# at once. Inside `with allocating(arena):`, every bit, bus and gate that
+# is created comes from the arena instead of being allocated on its own.
+
+
+class Arena:
+    active = []
+
+    def __init__(self, gate_params=None, block=ARENA_BLOCK):
+        self.gate_params = gate_params or GATE_PARAMS
+        self.block = block
+        self.blocks = []
+        self.size = 0
+        self.used = 0
+
+    def allocate(self, length):
+        if self.used + length > self.size:
+            self.size = max(length, self.block)
+            self.blocks.append((self.size, create_ciphertext_array(self.size, self.gate_params)))
+            self.used = 0
+        size, block = self.blocks[-1]
+        samples = [get_ciphertext(block, self.used + i) for i in range(length)]
+        self.used += length
+        return samples
+
+    def close(self):
+        for size, block in self.blocks:
+            delete_ciphertext_array(size, block)
+        self.blocks = []
+        self.size = 0
+        self.used = 0
+
+
+@contextmanager
+def allocating(arena):
+    Arena.active.append(arena)
+    try:
+        yield arena
+    finally:
+        Arena.active.pop()
+
+
+def create_bits(length):
+    if Arena.active:
+        return Arena.active[-1].allocate(length)
+    return [create_ciphertext(GATE_PARAMS) for i in range(length)]
+
+
+def create_bit():
+    return create_bits(1)[0]
+
+
+def create_bus(bits=ARCHITECTURE):
+    return create_bits(bits)
+
+
+def create_ram(width=RAM_WIDTH, bits=ARCHITECTURE):
+    samples = create_bits(width * bits)
+    return [samples[i:i + bits] for i in range(0, len(samples), bits)]
+
+
+# Only for bits and buses that weren't allocated from an arena
+def delete_bus(bus):
+    for bit in bus:
+        delete_ciphertext(bit)
 
 
 class Circuit(ABC):
@@ -36,18 +120,67 @@ class Circuit(ABC):
     def eval(self, cloud_key):
         pass
 
+    # Yield every gate of the circuit by walking its sub-circuits, which
+    # are stored as attributes or in lists of attributes, along with its
+    # path of attribute names, like ("cpu", "nest", "left", "adder[7]", "x1").
+    def flatten(self, path=()):
+        for name, value in vars(self).items():
+            if isinstance(value, list):
+                for i, circuit in enumerate(value):
+                    if isinstance(circuit, Circuit):
+                        yield from circuit.flatten(path + ("%s[%d]" % (name, i),))
+            elif isinstance(value, Circuit):
+                yield from value.flatten(path + (name,))
+
+
+# Inside `with structural_hashing():`, constructing a gate of the same type
+# on the same inputs as an earlier one returns the earlier gate, so logic
+# that several circuits build independently is only evaluated once.
+
+
+class GateType(ABCMeta):
+    tables = []
+
+    def __call__(cls, *inputs):
+        if not GateType.tables:
+            return ABCMeta.__call__(cls, *inputs)
+        table = GateType.tables[-1]
+        key = (cls, cls.key(inputs))
+        if key not in table:
+            table[key] = ABCMeta.__call__(cls, *inputs)
+        return table[key]
+
+
+@contextmanager
+def structural_hashing():
+    GateType.tables.append({})
+    try:
+        yield
+    finally:
+        GateType.tables.pop()
+
+
+class Gate(Circuit, metaclass=GateType):
+    commutative = False
+
+    @classmethod
+    def key(cls, inputs):
+        addresses = tuple(get_ciphertext_address(sample) for sample in inputs)
+        return tuple(sorted(addresses)) if cls.commutative else addresses
 
-class Gate(Circuit):
     def __init__(self, apply, inputs):
         Circuit.__init__(self)
         self.inputs = inputs
         self.apply = apply
-        self.value = create_ciphertext(GATE_PARAMS)
+        self.value = create_bit()
 
     def eval(self, cloud_key):
         inputs = self.inputs
         self.apply(self.value, *inputs, cloud_key)
 
+    def flatten(self, path=()):
+        yield path, self
+
 
 class Not(Gate):
     def __init__(self, *inputs):
@@ -55,36 +188,52 @@ class Not(Gate):
 
 
 class Constant(Gate):
+    @classmethod
+    def key(cls, inputs):
+        return tuple(map(int, inputs))
+
     def __init__(self, value):
         Gate.__init__(self, tfhe.bootsCONSTANT, (int(value),))
 
 
 class NAND(Gate):
+    commutative = True
+
     def __init__(self, *inputs):
         Gate.__init__(self, tfhe.bootsNAND, inputs)
 
 
 class OR(Gate):
+    commutative = True
+
     def __init__(self, *inputs):
         Gate.__init__(self, tfhe.bootsOR, inputs)
 
 
 class AND(Gate):
+    commutative = True
+
     def __init__(self, *inputs):
         Gate.__init__(self, tfhe.bootsAND, inputs)
 
 
 class XOR(Gate):
+    commutative = True
+
     def __init__(self, *inputs):
         Gate.__init__(self, tfhe.bootsXOR, inputs)
 
 
 class XNOR(Gate):
+    commutative = True
+
     def __init__(self, *inputs):
         Gate.__init__(self, tfhe.bootsXNOR, inputs)
 
 
 class NOR(Gate):
+    commutative = True
+
     def __init__(self, *inputs):
         Gate.__init__(self, tfhe.bootsNOR, inputs)
 
@@ -120,9 +269,8 @@ TRUE = Constant(True)
 FALSE = Constant(False)
 
 
-def create_constant(value):
-    bits = encode(value)
-    return [TRUE.value if bit else FALSE.value for bit in bits]
+def create_constant(value, bits=ARCHITECTURE):
+    return [TRUE.value if bit else FALSE.value for bit in encode(value, bits)]
 
 
 ZERO = create_constant(0)
@@ -156,10 +304,10 @@ class BitAdder(Circuit):
 class BusAdder(Circuit):
     def __init__(self, a, b):
         Circuit.__init__(self)
-        self.value = [None] * ARCHITECTURE
-        self.adder = [None] * ARCHITECTURE
+        self.value = [None] * len(a)
+        self.adder = [None] * len(a)
         carry = FALSE.value
-        for i in reversed(range(ARCHITECTURE)):
+        for i in reversed(range(len(a))):
             adder = BitAdder(a[i], b[i], carry)
             carry = adder.carry
             self.adder[i] = adder
@@ -171,12 +319,83 @@ class BusAdder(Circuit):
             adder.eval(cloud_key)
 
 
+# Incrementer adds 1 to a, or subtracts 1 if negative is set, but only if
+# enable is set. The carry into each bit is the enable bit, and the carry
+# out of a bit is the carry into it if the bit is 1 when counting up or 0
+# when counting down. That's 3 gates for every bit, rather than the 5 of
+# a BitAdder and a MUX to pick the delta.
+
+
+class Incrementer(Circuit):
+    def __init__(self, a, enable, negative):
+        Circuit.__init__(self)
+        self.gates = []
+        self.value = [None] * len(a)
+        carry = enable
+        for i in reversed(range(len(a))):
+            sum = XOR(a[i], carry)
+            self.gates.append(sum)
+            self.value[i] = sum.value
+            if i > 0:
+                propagate = XOR(a[i], negative)
+                gate = AND(propagate.value, carry)
+                carry = gate.value
+                self.gates.append(propagate)
+                self.gates.append(gate)
+
+    def eval(self, cloud_key):
+        for gate in self.gates:
+            gate.eval(cloud_key)
+
+
+# CountAdder adds count + 1 to a, or subtracts count + 1 if negative is
+# set, but only if enable is set. count is unsigned. Subtracting count + 1
+# is adding NOT count, and adding count + 1 is adding count with a carry in.
+
+
+class CountAdder(Circuit):
+    def __init__(self, a, enable, negative, count):
+        Circuit.__init__(self)
+        self.down = AND(enable, negative)
+        self.up = ANDYN(enable, negative)
+        self.gates = []
+        count = count[-len(a):]
+        operand = [self.down.value] * (len(a) - len(count))
+        for bit in count:
+            flip = XOR(bit, negative)
+            gate = AND(enable, flip.value)
+            self.gates.append(flip)
+            self.gates.append(gate)
+            operand.append(gate.value)
+        self.value = [None] * len(a)
+        self.adder = [None] * len(a)
+        carry = self.up.value
+        for i in reversed(range(len(a))):
+            adder = BitAdder(a[i], operand[i], carry)
+            carry = adder.carry
+            self.adder[i] = adder
+            self.value[i] = adder.value
+
+    def eval(self, cloud_key):
+        self.down.eval(cloud_key)
+        self.up.eval(cloud_key)
+        for gate in self.gates:
+            gate.eval(cloud_key)
+        for adder in reversed(self.adder):
+            adder.eval(cloud_key)
+
+
+# Equal starts from `enable` if it is given, so that it is only true when
+# enable is. Under structural hashing, Equals with the same enable on the
+# same bus share the gates of their common prefix.
+
+
 class Equal(Circuit):
-    def __init__(self, a, b):
+    def __init__(self, a, b, enable=None):
         Circuit.__init__(self)
         self.gates = []
-        value = TRUE.value
-        for i in range(ARCHITECTURE):
+        value = TRUE.value if enable is None else enable
+        for i in range(len(a)):
             equal = XNOR(a[i], b[i])
             gate = AND(value, equal.value)
             value = gate.value
@@ -209,7 +428,7 @@ class Switch(Circuit):
     def __init__(self, condition, a, b):
         Circuit.__init__(self)
         self.condition = condition
-        self.muxes = [MUX(condition, a[i], b[i]) for i in range(ARCHITECTURE)]
+        self.muxes = [MUX(condition, a[i], b[i]) for i in range(len(a))]
         self.value = [mux.value for mux in self.muxes]
 
     def eval(self, cloud_key):
@@ -217,23 +436,43 @@ class Switch(Circuit):
             mux.eval(cloud_key)
 
 
+# Index selects array[index] with a tree of Switches, one level for each
+# bit of the index from the least significant up, and zero if the index
+# is out of range. The buses are `bits` wide, which defaults to the width
+# of the first one, or to ARCHITECTURE if the array is empty.
+
+
 class Index(Circuit):
-    def __init__(self, index, array):
+    def __init__(self, index, array, bits=None):
+        Circuit.__init__(self)
         self.index = index
         self.array = array
         self.elements = []
-        value = ZERO
-        for i, element in enumerate(array):
-            equal = Equal(create_constant(i), self.index)
-            switch = Switch(equal.value, element, value)
-            value = switch.value
-            self.elements.append(equal)
-            self.elements.append(switch)
-        self.value = value
+        if bits is None:
+            bits = len(array[0]) if array else ARCHITECTURE
+        zero = create_constant(0, bits)
+        values = list(array[:2 ** len(index)]) or [zero]
+        bit = len(index)
+        while len(values) > 1:
+            bit -= 1
+            if len(values) % 2:
+                values.append(zero)
+            level = []
+            for low, high in zip(values[::2], values[1::2]):
+                switch = Switch(index[bit], high, low)
+                self.elements.append(switch)
+                level.append(switch.value)
+            values = level
+
+        self.zero = Zero(index[:bit])
+        self.switch = Switch(self.zero.value, values[0], zero)
+        self.value = self.switch.value
 
     def eval(self, cloud_key):
         for element in self.elements:
             element.eval(cloud_key)
+        self.zero.eval(cloud_key)
+        self.switch.eval(cloud_key)
 
 
 class Alive(Circuit):
@@ -276,15 +515,13 @@ class Direction(Circuit):
 
 
 class Nest(Circuit):
-    def __init__(self, alive, nest, loop, delta):
+    def __init__(self, alive, nest, loop, negative):
         Circuit.__init__(self)
-        self.delta = Switch(loop, delta, ZERO)
-        self.left = BusAdder(nest, self.delta.value)
-        self.switch = Switch(alive, ZERO, self.left.value)
+        self.left = Incrementer(nest, loop, negative)
+        self.switch = Switch(alive, create_constant(0, len(nest)), self.left.value)
         self.value = self.switch.value
 
     def eval(self, cloud_key):
-        self.delta.eval(cloud_key)
         self.left.eval(cloud_key)
         self.switch.eval(cloud_key)
 
@@ -292,25 +529,31 @@ class Nest(Circuit):
 # CPU is a circuit that maps
 # (instruction, value, direction, nest)
 # to
-# (delta_instruction, delta_value, direction, nest)
-# The Computer actually computes the deltas before feeding back
+# (move, edit, input, output, negative, direction, nest)
+# where move and edit are whether to step the data pointer or the value,
+# and negative is whether to step it down rather than up. input and output
+# are whether to read the value from the input or write it to the output.
+# The Computer actually computes the steps before feeding back
 
 
 class CPU(Circuit):
     def __init__(self, instruction, value, direction, alive, nest):
         Circuit.__init__(self)
+        self.negative = instruction[-1]
         self.loop = AND(instruction[-2], instruction[-3])
         self.open = ANDYN(self.loop.value, instruction[-1])
         self.close = AND(self.loop.value, instruction[-1])
-        self.delta = Switch(instruction[-1], NEGATIVE_ONE, POSITIVE_ONE)
 
         self.move = NOR(instruction[-2], instruction[-3])
         self.move_alive = AND(alive, self.move.value)
-        self.move_delta = Switch(self.move_alive.value, self.delta.value, ZERO)
 
         self.edit = ANDYN(instruction[-2], instruction[-3])
         self.edit_alive = AND(alive, self.edit.value)
-        self.edit_delta = Switch(self.edit_alive.value, self.delta.value, ZERO)
+
+        self.io = ANDYN(instruction[-3], instruction[-2])
+        self.io_alive = AND(alive, self.io.value)
+        self.input = AND(self.io_alive.value, instruction[-1])
+        self.output = ANDYN(self.io_alive.value, instruction[-1])
 
         self.nest_zero = Zero(nest)
         self.value_zero = Zero(value)
@@ -320,21 +563,23 @@ class CPU(Circuit):
 
         self.direction = Direction(direction, alive, nest_zero, value_zero, self.open.value, self.close.value)
         self.alive = Alive(direction, alive, nest_zero, value_zero, self.open.value, self.close.value, self.loop.value, instruction[-1])
-        self.nest = Nest(alive, nest, self.loop.value, self.delta.value)
+        self.nest = Nest(alive, nest, self.loop.value, self.negative)
 
     def eval(self, cloud_key):
         self.loop.eval(cloud_key)
         self.open.eval(cloud_key)
         self.close.eval(cloud_key)
-        self.delta.eval(cloud_key)
 
         self.move.eval(cloud_key)
         self.move_alive.eval(cloud_key)
-        self.move_delta.eval(cloud_key)
 
         self.edit.eval(cloud_key)
         self.edit_alive.eval(cloud_key)
-        self.edit_delta.eval(cloud_key)
+
+        self.io.eval(cloud_key)
+        self.io_alive.eval(cloud_key)
+        self.input.eval(cloud_key)
+        self.output.eval(cloud_key)
 
         self.nest_zero.eval(cloud_key)
         self.value_zero.eval(cloud_key)
@@ -345,67 +590,375 @@ class CPU(Circuit):
 
 
 class RAM(Circuit):
-    def __init__(self, data, data_pointer, data_delta):
+    def __init__(self, data, data_pointer, edit, negative):
         self.data = data
         self.pointer = data_pointer
-        self.delta = data_delta
         self.elements = []
         self.value = []
-        for i in range(RAM_WIDTH):
-            equal = Equal(self.pointer, create_constant(i))
-            switch = Switch(equal.value, self.delta, ZERO)
-            adder = BusAdder(self.data[i], switch.value)
+        for i in range(len(data)):
+            equal = Equal(self.pointer, create_constant(i, len(data_pointer)), edit)
+            incrementer = Incrementer(self.data[i], equal.value, negative)
+            self.elements.append(equal)
+            self.elements.append(incrementer)
+            self.value.append(incrementer.value)
+
+    def eval(self, cloud_key):
+        for element in self.elements:
+            element.eval(cloud_key)
+
+
+# WriteBackRAM writes `value` to the cell that the pointer points to, if
+# enable is set or not given, and leaves every other cell as it is.
+
+
+class WriteBackRAM(Circuit):
+    def __init__(self, data, pointer, value, enable=None):
+        self.data = data
+        self.pointer = pointer
+        self.elements = []
+        self.value = []
+        for i in range(len(data)):
+            equal = Equal(self.pointer, create_constant(i, len(pointer)), enable)
+            switch = Switch(equal.value, value, self.data[i])
             self.elements.append(equal)
             self.elements.append(switch)
-            self.elements.append(adder)
-            self.value.append(adder.value)
+            self.value.append(switch.value)
 
     def eval(self, cloud_key):
         for element in self.elements:
             element.eval(cloud_key)
 
 
+# A Computer with `ram_width` cells of `word_bits` bits, and an instruction
+# pointer of `ip_bits` bits, which is also the width of the loop nesting
+# counter. The data pointer has `dp_bits` bits, which defaults to the word
+# size or as many bits as it takes to address every cell if that is more;
+# with (ram_width - 1).bit_length() bits it wraps around the RAM instead of
+# running off its ends. The RAM and the ROM have to fit their pointers. The instructions can be any width of
+# at least 3 bits (see compile_code). A compact Computer runs code that
+# was compiled with compact=True, and steps the data pointer and the value
+# by the count in the instructions.
+#
+# "," reads the next bus of `inputs`, an encrypted input tape of words
+# that belongs to the caller, or 0 once all of them have been read, and
+# doesn't do anything if there are no inputs. With an `output_width`,
+# which has to be a power of two, "." writes the value to a ring buffer
+# of that many words, and otherwise doesn't do anything. The ring buffer
+# can only fill up in output_width cycles, so it has to be read that
+# often (see flush and unread_outputs).
+#
+# With a table of `costs`, the netlist is remapped to the gates that cost
+# the least under it (see map_technology, and measure_costs for a table
+# measured on this host), and `mapping` holds the cost before and after.
+
+
 class Computer(Circuit):
-    def __init__(self, instructions):
+    def __init__(self, instructions, workers=1, processes=None, profile=False,
+                 ram_width=RAM_WIDTH, word_bits=ARCHITECTURE, ip_bits=ARCHITECTURE, dp_bits=None, compact=False,
+                 inputs=None, output_width=0, native=False, costs=None, cache=TFHE_CACHE):
         Circuit.__init__(self)
+        if any(len(bus) != word_bits for bus in inputs or []):
+            raise ValueError("every input has to have %d bits" % word_bits)
+        if output_width and (output_width < 2 or output_width & (output_width - 1)):
+            raise ValueError("the output width has to be a power of two and at least 2")
+        if dp_bits is None:
+            dp_bits = max(word_bits, (ram_width - 1).bit_length())
+        if ram_width > 2 ** dp_bits:
+            raise ValueError("%d cells don't fit a %d bit data pointer" % (ram_width, dp_bits))
+        if len(instructions) > 2 ** ip_bits:
+            raise ValueError("%d instructions don't fit a %d bit instruction pointer" % (len(instructions), ip_bits))
+        self.compact = compact
+        self.inputs = inputs or []
+        self.output_width = output_width
+        self.ram_width = ram_width
+        self.word_bits = word_bits
+        self.ip_bits = ip_bits
+        self.dp_bits = dp_bits
+        self.arena = Arena(GATE_PARAMS)
+        parameters = {
+            "sources": SOURCES,
+            "rom_length": len(instructions),
+            "instruction_bits": len(instructions[0]) if instructions else 0,
+            "ram_width": ram_width,
+            "word_bits": word_bits,
+            "ip_bits": ip_bits,
+            "dp_bits": self.dp_bits,
+            "compact": compact,
+            "inputs": len(self.inputs),
+            "output_width": output_width,
+            "costs": costs,
+        }
+        description = load_netlist(parameters, cache)
+        if description is None:
+            description = self.construct(instructions, costs)
+            if cache is not None:
+                description = store_netlist(parameters, description, cache)
+        self.load(instructions, description)
+        self.registers = self.netlist.registers
+        self.bind()
+        if profile:
+            self.executor = ProfilingExecutor(self.netlist, workers)
+        elif native:
+            self.executor = NativeExecutor(self.netlist)
+        elif processes is None:
+            self.executor = Executor(self.netlist, workers)
+        else:
+            self.executor = SharedExecutor(self.netlist, processes, GATE_PARAMS)
+        self.cycle = 0
+
+    # Build the circuits on a scratch Computer, flatten them into a netlist
+    # and describe it. The ciphertexts of the scratch Computer are freed
+    # again, since the netlist only needs one for every slot.
+    def construct(self, instructions, costs):
+        scratch = Computer.__new__(Computer)
+        scratch.__dict__.update(self.__dict__)
+        scratch.arena = Arena(GATE_PARAMS)
+        try:
+            with allocating(scratch.arena), structural_hashing():
+                scratch.build(instructions)
+            netlist = Netlist(scratch, scratch.outputs())
+            netlist.propagate_constants(TRUE.value, FALSE.value)
+            mapping = None
+            if costs is not None:
+                mapping = netlist.map_technology(costs, scratch.arena.allocate)
+            netlist.register(scratch.instruction_pointer, scratch.instruction_incrementer.value)
+            netlist.register(scratch.data_pointer, scratch.data_incrementer.value)
+            netlist.register([scratch.direction], [scratch.cpu.direction.value])
+            netlist.register([scratch.alive], [scratch.cpu.alive.value])
+            netlist.register(scratch.nest, scratch.cpu.nest.value)
+            for bus, value in zip(scratch.data, scratch.ram.value):
+                netlist.register(bus, value)
+            if scratch.inputs:
+                netlist.register(scratch.input_head, scratch.input_incrementer.value)
+            if scratch.output_width:
+                netlist.register(scratch.output_head, scratch.output_incrementer.value)
+                for bus, value in zip(scratch.output, scratch.output_ram.value):
+                    netlist.register(bus, value)
+            return dict(netlist.describe(scratch.buses(instructions)), mapping=mapping)
+        finally:
+            scratch.arena.close()
+
+    # The buses that a loaded netlist has to find again. The instructions,
+    # inputs and constants belong to someone else, and the registers are
+    # found through the registers of the netlist.
+    def buses(self, instructions):
+        return {
+            "instructions": instructions,
+            "inputs": self.inputs,
+            "constants": [[TRUE.value, FALSE.value]],
+            "instruction": [self.instruction],
+            "value": [self.value],
+        }
+
+    # Load the netlist from its description, allocating nothing but a
+    # ciphertext for every slot that isn't the caller's
+    def load(self, instructions, description):
+        slots = description["slots"]
+        samples = [None] * (max(slots, default=-1) + 1)
+        buses = description["buses"]
+        for name, value in [("instructions", instructions), ("inputs", self.inputs), ("constants", [[TRUE.value, FALSE.value]])]:
+            for bus, bits in zip(buses[name], value):
+                for wire, sample in zip(bus, bits):
+                    samples[slots[wire]] = sample
+        free = [slot for slot, sample in enumerate(samples) if sample is None]
+        for slot, sample in zip(free, self.arena.allocate(len(free))):
+            samples[slot] = sample
+        wires = [samples[slot] for slot in slots]
+        self.instructions = instructions
+        self.netlist = Netlist.load(description, wires)
+        self.instruction = [wires[wire] for wire in buses["instruction"][0]]
+        self.value = [wires[wire] for wire in buses["value"][0]]
+        self.mapping = tuple(description["mapping"]) if description["mapping"] is not None else None
+
+    def build(self, instructions):
         self.instructions = instructions
-        self.instruction_pointer = create_bus()
+        self.instruction_pointer = create_bus(self.ip_bits)
         self.instruction_index = Index(self.instruction_pointer, self.instructions)
         self.instruction = self.instruction_index.value
-        self.direction = create_ciphertext(GATE_PARAMS)
-        self.alive = create_ciphertext(GATE_PARAMS)
-        self.nest = create_bus()
+        self.direction = create_bit()
+        self.alive = create_bit()
+        self.nest = create_bus(self.ip_bits)
 
-        self.data = create_ram()
-        self.data_pointer = create_bus()
-        self.data_index = Index(self.data_pointer, self.data)
+        self.data = create_ram(self.ram_width, self.word_bits)
+        self.data_pointer = create_bus(self.dp_bits)
+        self.data_index = Index(self.data_pointer, self.data, self.word_bits)
         self.value = self.data_index.value
 
         self.cpu = CPU(self.instruction, self.value, self.direction, self.alive, self.nest)
 
-        self.instruction_switch = Switch(self.cpu.direction.value, POSITIVE_ONE, NEGATIVE_ONE)
-        self.instruction_adder = BusAdder(self.instruction_switch.value, self.instruction_pointer)
-
-        self.data_adder = BusAdder(self.cpu.move_delta.value, self.data_pointer)
-
-        self.ram = RAM(self.data, self.data_pointer, self.cpu.edit_delta.value)
-
-    def eval(self, cloud_key):
-        self.instruction_index.eval(cloud_key)
-        self.data_index.eval(cloud_key)
-        self.cpu.eval(cloud_key)
-        self.instruction_switch.eval(cloud_key)
-        self.instruction_adder.eval(cloud_key)
-        self.data_adder.eval(cloud_key)
-        self.ram.eval(cloud_key)
-
-        copy_bus(self.instruction_pointer, self.instruction_adder.value, cloud_key)
-        copy_bus(self.data_pointer, self.data_adder.value, cloud_key)
-        copy_bit(self.direction, self.cpu.direction.value, cloud_key)
-        copy_bit(self.alive, self.cpu.alive.value, cloud_key)
-        copy_bus(self.nest, self.cpu.nest.value, cloud_key)
-        for r, v in zip(self.data, self.ram.value):
-            copy_bus(r, v, cloud_key)
+        self.backward = Not(self.cpu.direction.value)
+        self.instruction_incrementer = Incrementer(self.instruction_pointer, TRUE.value, self.backward.value)
+
+        # Compact code and input both need the new value of the current
+        # cell, which is then written back. Otherwise every cell steps itself.
+        if self.compact:
+            count = self.instruction[:-3]
+            self.data_incrementer = CountAdder(self.data_pointer, self.cpu.move_alive.value, self.cpu.negative, count)
+            self.value_adder = CountAdder(self.value, self.cpu.edit_alive.value, self.cpu.negative, count)
+        else:
+            self.data_incrementer = Incrementer(self.data_pointer, self.cpu.move_alive.value, self.cpu.negative)
+            if self.inputs:
+                self.value_adder = Incrementer(self.value, self.cpu.edit_alive.value, self.cpu.negative)
+
+        if self.inputs:
+            self.input_head = create_bus(len(self.inputs).bit_length())
+            self.input_index = Index(self.input_head, self.inputs, self.word_bits)
+            self.input_switch = Switch(self.cpu.input.value, self.input_index.value, self.value_adder.value)
+            self.input_end = Equal(self.input_head, create_constant(len(self.inputs), len(self.input_head)))
+            self.input_enable = ANDYN(self.cpu.input.value, self.input_end.value)
+            self.input_incrementer = Incrementer(self.input_head, self.input_enable.value, FALSE.value)
+            self.ram = WriteBackRAM(self.data, self.data_pointer, self.input_switch.value)
+        elif self.compact:
+            self.ram = WriteBackRAM(self.data, self.data_pointer, self.value_adder.value)
+        else:
+            self.ram = RAM(self.data, self.data_pointer, self.cpu.edit_alive.value, self.cpu.negative)
+
+        # The output head has one more bit than it takes to index the ring
+        # buffer, so that a full ring buffer can be told from an empty one.
+        if self.output_width:
+            self.output_head = create_bus((self.output_width - 1).bit_length() + 1)
+            self.output = create_ram(self.output_width, self.word_bits)
+            self.output_ram = WriteBackRAM(self.output, self.output_head[1:], self.value, self.cpu.output.value)
+            self.output_incrementer = Incrementer(self.output_head, self.cpu.output.value, FALSE.value)
+
+    # The wires that are read after every cycle
+    def outputs(self):
+        outputs = [self.cpu.direction.value, self.cpu.alive.value]
+        outputs += self.instruction + self.value + self.cpu.nest.value
+        outputs += self.instruction_incrementer.value + self.data_incrementer.value
+        for bus in self.ram.value:
+            outputs += bus
+        if self.inputs:
+            outputs += self.input_incrementer.value
+        if self.output_width:
+            outputs += self.output_incrementer.value
+            for bus in self.output_ram.value:
+                outputs += bus
+        return outputs
+
+    # With native=True, all of the cycles run in a single call into tfhe_io.so
+    def eval(self, cloud_key, cycles=1):
+        self.executor.run(cloud_key, cycles)
+        self.commit()
+        self.cycle += cycles
+
+    # Evaluate until `cycles` cycles have run in total. With a path, the
+    # state is checkpointed there every `checkpoint_every` cycles and at the
+    # end, and a checkpoint that is already there is resumed from first.
+    # With an output file, the output is flushed to it every output_width
+    # cycles and at the end.
+    def run(self, cloud_key, cycles, checkpoint_every=None, path=None, output=None):
+        if checkpoint_every is not None and path is None:
+            raise ValueError("checkpoints need a path")
+        if checkpoint_every is not None and checkpoint_every < 1:
+            raise ValueError("checkpoint_every has to be at least 1")
+        if output is not None and not self.output_width:
+            raise ValueError("output needs a Computer with an output_width")
+        if path is not None and os.path.exists(path):
+            self.restore(path)
+        while self.cycle < cycles:
+            batch = cycles - self.cycle
+            for every in [checkpoint_every, self.output_width if output is not None else None]:
+                if every is not None:
+                    batch = min(batch, every - self.cycle % every)
+            self.eval(cloud_key, batch)
+            if output is not None and self.cycle % self.output_width == 0:
+                self.flush(output)
+            if checkpoint_every is not None and self.cycle % checkpoint_every == 0:
+                self.checkpoint(path)
+        if output is not None:
+            self.flush(output)
+        if path is not None:
+            self.checkpoint(path)
+
+    # Append the output head and the ring buffer to a binary file, one
+    # record per bit. Read them back with load_snapshot(frame, output_lengths()).
+    def flush(self, file):
+        for bus in [self.output_head] + self.output:
+            for bit in bus:
+                file.write(pack_ciphertext(bit, GATE_PARAMS))
+        file.flush()
+
+    def output_lengths(self):
+        return [len(self.output_head)] + [self.word_bits] * self.output_width
+
+    # Evaluate `every` cycles at a time, up to `cycles` cycles in total or
+    # forever, and yield the cycle and a snapshot after each batch: the
+    # alive bit, the instruction pointer and the data pointer, the RAM if
+    # ram is set and the output head and ring buffer if output is set,
+    # packed into one record per bit (see snapshot_lengths).
+    # The snapshot is a view of a buffer that is reused for every snapshot,
+    # so it is only valid until the next one. Nothing runs while the caller
+    # isn't asking for the next snapshot, and closing the generator stops it.
+    def stream(self, cloud_key, every=1, ram=False, cycles=None, output=False):
+        if every < 1:
+            raise ValueError("every has to be at least 1")
+        if output and not self.output_width:
+            raise ValueError("output needs a Computer with an output_width")
+        if output and every > self.output_width:
+            raise ValueError("the output has to be streamed at least every %d cycles" % self.output_width)
+        size = get_ciphertext_size(GATE_PARAMS)
+        buffer = memoryview(bytearray(size * sum(self.snapshot_lengths(ram, output))))
+        while cycles is None or self.cycle < cycles:
+            self.eval(cloud_key, every if cycles is None else min(every, cycles - self.cycle))
+            offset = 0
+            buses = [[self.alive], self.instruction_pointer, self.data_pointer]
+            buses += self.data if ram else []
+            buses += [self.output_head] + self.output if output else []
+            for bus in buses:
+                for bit in bus:
+                    pack_ciphertext_into(buffer[offset:offset + size], bit, GATE_PARAMS)
+                    offset += size
+            yield self.cycle, buffer
+
+    def snapshot_lengths(self, ram=False, output=False):
+        lengths = [1, self.ip_bits, self.dp_bits]
+        lengths += [self.word_bits] * self.ram_width if ram else []
+        lengths += self.output_lengths() if output else []
+        return lengths
+
+    # Write every register to a container at path, atomically
+    def checkpoint(self, path):
+        state = [register.value() for register in self.registers]
+        write_container(path, state, GATE_PARAMS, {"cycle": self.cycle})
+
+    def restore(self, path):
+        with Container(path, GATE_PARAMS) as container:
+            if [container.bits(i) for i in range(len(container))] != [len(r.state) for r in self.registers]:
+                raise ValueError(path + " is a checkpoint of a different Computer")
+            for i, register in enumerate(self.registers):
+                container.load(i, register.value())
+            self.cycle = container.metadata["cycle"]
+
+    # Free every ciphertext of the Computer except for the instructions,
+    # which belong to the caller. The Computer can't be evaluated afterwards.
+    def close(self):
+        self.executor.close()
+        self.arena.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    # Swap the registers to the values computed this cycle. The buses of
+    # the Computer are rebound to the buffers that now hold the state.
+    def commit(self):
+        self.netlist.commit()
+        self.bind()
+
+    def bind(self):
+        registers = [register.value() for register in self.registers]
+        self.instruction_pointer, self.data_pointer, direction, alive, self.nest = registers[:5]
+        self.direction, self.alive = direction[0], alive[0]
+        self.data = registers[5:5 + self.ram_width]
+        registers = registers[5 + self.ram_width:]
+        if self.inputs:
+            self.input_head = registers.pop(0)
+        if self.output_width:
+            self.output_head = registers.pop(0)
+            self.output = registers
 
     def init(self, cloud_key):
         for bit in self.instruction_pointer:
@@ -419,6 +972,16 @@ class Computer(Circuit):
             tfhe.bootsCONSTANT(bit, 0, cloud_key)
         tfhe.bootsCONSTANT(self.direction, 1, cloud_key)
         tfhe.bootsCONSTANT(self.alive, 1, cloud_key)
+        if self.inputs:
+            for bit in self.input_head:
+                tfhe.bootsCONSTANT(bit, 0, cloud_key)
+        if self.output_width:
+            for bit in self.output_head:
+                tfhe.bootsCONSTANT(bit, 0, cloud_key)
+            for bus in self.output:
+                for bit in bus:
+                    tfhe.bootsCONSTANT(bit, 0, cloud_key)
+        self.cycle = 0
 
 
 '''
@@ -433,26 +996,73 @@ class Computer(Circuit):
 '''
 
 operations = {
-    ">": encode(0),
-    "<": encode(1),
-    "+": encode(2),
-    "-": encode(3),
-    ".": encode(4),
-    ",": encode(5),
-    "[": encode(6),
-    "]": encode(7)
+    ">": 0,
+    "<": 1,
+    "+": 2,
+    "-": 3,
+    ".": 4,
+    ",": 5,
+    "[": 6,
+    "]": 7
 }
 
 
-def compile_code(code, secret_key):
-    rom = []
-    for char in code:
-        bits = operations[char]
-        bus = create_bus()
-        for value, sample in zip(bits, bus):
-            encrypt(sample, value, secret_key)
-        rom.append(bus)
-    return rom
+# The opcode of an instruction is in its last 3 bits. With compact=True,
+# a run of up to 2 ** (bits - 3) of the same one of "+-<>" is a single
+# instruction with the length of the run minus one in the other bits.
+def assemble(code, bits=ARCHITECTURE, compact=False):
+    instructions = []
+    limit = 2 ** (bits - 3) if compact else 1
+    i = 0
+    while i < len(code):
+        count = 1
+        if code[i] in "+-<>":
+            while count < limit and i + count < len(code) and code[i + count] == code[i]:
+                count += 1
+        instructions.append((count - 1) * 8 + operations[code[i]])
+        i += count
+    return instructions
+
+
+# The CPU only reads the last 3 bits of an instruction, so `bits` can be as
+# small as 3, or more to leave room for the counts of compact code.
+def compile_code(code, secret_key, bits=ARCHITECTURE, compact=False):
+    return encrypt_words(assemble(code, bits, compact), secret_key, bits)
+
+
+# Unpack a snapshot from Computer.stream into new buses with the given lengths
+def load_snapshot(snapshot, lengths):
+    size = get_ciphertext_size(GATE_PARAMS)
+    buses = []
+    offset = 0
+    for length in lengths:
+        bus = create_bits(length)
+        for bit in bus:
+            unpack_ciphertext(snapshot[offset:offset + size], bit, GATE_PARAMS)
+            offset += size
+        buses.append(bus)
+    return buses
+
+
+# The buses of an output ring buffer that were written since the output
+# head was at `last`, where `head` is where it is now. Both heads are the
+# decrypted output heads of consecutive flushes.
+def unread_outputs(output, last, head):
+    return [output[(last + i) % len(output)] for i in range((head - last) % (2 * len(output)))]
+
+
+# Encrypts an input tape, one word of `bits` bits for every value
+def compile_input(values, secret_key, bits=ARCHITECTURE):
+    return encrypt_words(values, secret_key, bits)
+
+
+# Encrypt a bus of `bits` bits for every value, with one call to encrypt_bits.
+# It encodes them with encode rather than encode_words, so compiling code
+# doesn't need NumPy.
+def encrypt_words(values, secret_key, bits=ARCHITECTURE):
+    samples = create_bits(len(values) * bits)
+    encrypt_bits(samples, [bit for value in values for bit in encode(value, bits)], secret_key)
+    return [samples[i:i + bits] for i in range(0, len(samples), bits)]
 
 
 def copy_bit(result, value, cloud_key):
@@ -469,49 +1079,45 @@ def get(bus, secret_key):
     return decode(bits)
 
 
+# Decrypt and decode buses of the same width (like the RAM) all at once,
+# into a NumPy array with a value for every bus (and lane)
+def get_words(buses, secret_key, threads=1):
+    import numpy
+    if not buses:
+        return numpy.zeros(0, dtype=numpy.int64)
+    bits = decrypt_bits([sample for bus in buses for sample in bus], secret_key, threads)
+    bits = numpy.frombuffer(bits, dtype=bool) if isinstance(bits, bytearray) else bits
+    bits = bits.reshape((len(buses), len(buses[0])) + bits.shape[1:])
+    return decode_words(numpy.moveaxis(bits, 1, -1))
+
+
 dir_path = os.path.dirname(os.path.realpath(__file__))
 
 
+# Buses are stored in a single container file (see container.py)
+
 def load_from_path(name):
-    if os.path.exists(dir_path + "/" + name):
-        bus = create_bus()
-        for i in range(ARCHITECTURE):
-            file = dir_path + "/" + name + "/" + str(i)
-            tfhe_io.import_ciphertext(file.encode(), bus[i], GATE_PARAMS)
-        return bus
+    code = import_code(name)
+    if code is not None:
+        return code[0]
 
 
 def write_to_path(name, bus):
-    if not os.path.exists(dir_path + "/" + name):
-        os.makedirs(dir_path + "/" + name)
-    for i in range(ARCHITECTURE):
-        file = dir_path + "/" + name + "/" + str(i)
-        tfhe_io.export_ciphertext(file.encode(), bus[i], GATE_PARAMS)
-
-
-def import_code(name):
-    dir_name = dir_path + "/" + name
-    if os.path.exists(dir_name):
-        code = {}
-        for i in os.listdir(dir_name):
-            print(i)
-            bus = create_bus()
-            for j in os.listdir(dir_name + "/" + i):
-                print(j)
-                file = dir_name + "/" + i + "/" + j
-                print(file)
-                tfhe_io.import_ciphertext(file.encode(), bus[int(j)], GATE_PARAMS)
-            code[int(i)] = bus
-        return [code[key] for key in sorted(code)]
+    export_code(name, [bus])
+
+
+# Returns the buses in [start, stop) without reading the others
+def import_code(name, start=0, stop=None):
+    path = os.path.join(dir_path, name)
+    if os.path.exists(path):
+        with Container(path, GATE_PARAMS) as container:
+            code = []
+            for i in range(len(container))[start:stop]:
+                bus = create_bits(container.bits(i))
+                container.load(i, bus)
+                code.append(bus)
+            return code
 
 
 def export_code(name, code):
-    dir_name = dir_path + "/" + name
-    if not os.path.exists(dir_name):
-        os.makedirs(dir_name)
-    for i in range(len(code)):
-        subdir_name = dir_name + "/" + str(i)
-        os.makedirs(subdir_name)
-        for j in range(ARCHITECTURE):
-            file = subdir_name + "/" + str(j)
-            tfhe_io.export_ciphertext(file.encode(), code[i][j], GATE_PARAMS)
+    write_container(os.path.join(dir_path, name), code, GATE_PARAMS)
@@ -0,0 +1,93 @@
+import json
+import mmap
+from tfhe import *
+
+
+# A container packs a list of buses into a single file:
+#
+#   header | index | metadata | records
+#
+# The header holds the parameters the ciphertexts were encrypted with, the
+# architecture, the number of buses and the size of the metadata. The index
+# holds the offset and the number of bits of every bus, and the metadata is
+# a JSON object for anything else that belongs with the buses. Every
+# ciphertext is a fixed size record (see pack_ciphertext), so any bus can be
+# read straight out of a memory map without parsing the ones before it.
+
+MAGIC = b"BFZC"
+VERSION = 2
+HEADER = struct.Struct("<4sIIdIIII")
+ENTRY = struct.Struct("<QI")
+
+
+def describe_params(gate_params):
+    if PLAINTEXT:
+        return tfhe.lanes, 0.0
+    params = get_lwe_params(gate_params).contents
+    return params.n, params.alpha_min
+
+
+# The file is written next to the path and moved into place once it is
+# complete, so readers never see a partial container.
+def write_container(path, buses, gate_params, metadata=None):
+    record_size = get_ciphertext_size(gate_params)
+    dimension, noise = describe_params(gate_params)
+    metadata = json.dumps(metadata or {}).encode()
+    offset = HEADER.size + ENTRY.size * len(buses) + len(metadata)
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, record_size, noise, dimension, ARCHITECTURE, len(buses), len(metadata)))
+        for bus in buses:
+            file.write(ENTRY.pack(offset, len(bus)))
+            offset += record_size * len(bus)
+        file.write(metadata)
+        for bus in buses:
+            for bit in bus:
+                file.write(pack_ciphertext(bit, gate_params))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+
+class Container:
+    def __init__(self, path, gate_params):
+        self.gate_params = gate_params
+        self.file = open(path, "rb")
+        # A private mapping, so records can be handed to ctypes without copying the file
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_COPY)
+        self.buffer = memoryview(self.map)
+
+        magic, version, self.record_size, noise, dimension, self.architecture, length, size = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(path + " is not a version %d container" % VERSION)
+        if self.record_size != get_ciphertext_size(gate_params) or (dimension, noise) != describe_params(gate_params):
+            raise ValueError(path + " was encrypted with different parameters")
+        self.entries = [ENTRY.unpack_from(self.map, HEADER.size + ENTRY.size * i) for i in range(length)]
+        start = HEADER.size + ENTRY.size * length
+        self.metadata = json.loads(bytes(self.buffer[start:start + size]))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def bits(self, index):
+        offset, bits = self.entries[index]
+        return bits
+
+    def load(self, index, bus):
+        offset, bits = self.entries[index]
+        if len(bus) != bits:
+            raise ValueError("bus %d has %d bits" % (index, bits))
+        for bit in bus:
+            unpack_ciphertext(self.buffer[offset:offset + self.record_size], bit, self.gate_params)
+            offset += self.record_size
+
+    def close(self):
+        self.buffer.release()
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
@@ -1,6 +1,7 @@
 from circuits import *
+from cache import *
 
-secret = create_secret_keyset(GATE_PARAMS)
+secret = load_secret_keyset(GATE_PARAMS)
 cloud = get_cloud_keyset(secret)
 
 TRUE.eval(cloud)
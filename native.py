@@ -0,0 +1,38 @@
+from array import array
+from netlist import *
+
+
+# A NativeExecutor compiles the netlist once into flat arrays of opcodes
+# and operands, and evaluates a whole batch of cycles, registers and all,
+# with a single call to run_netlist in tfhe_io.c. ctypes releases the GIL
+# for the length of the call. With the plaintext library, the same arrays
+# run in plaintext.py instead.
+# The registers have to be added to the netlist before the executor is made.
+
+
+class NativeExecutor:
+    def __init__(self, netlist):
+        self.netlist = netlist
+        self.opcodes = array("B")
+        self.operands = array("i")
+        for index in netlist.order():
+            operation, output, inputs = netlist.gates[index]
+            self.opcodes.append(OPCODES.index(operation))
+            self.operands.extend((output,) + tuple(inputs) + (0,) * (3 - len(inputs)))
+        self.swaps = array("i")
+        for register in netlist.registers:
+            for state, next in zip(register.state, register.next):
+                self.swaps.extend((state, next))
+
+    def eval(self, cloud_key):
+        self.run(cloud_key, 1)
+
+    # Like Executor.run. run_netlist swaps the registers between cycles on
+    # its own copy of the wires, so the netlist catches up afterwards.
+    def run(self, cloud_key, cycles):
+        run_netlist(self.netlist.wires, self.opcodes, self.operands, self.swaps, cycles, cloud_key)
+        if cycles % 2 == 0:
+            self.netlist.commit()
+
+    def close(self):
+        pass
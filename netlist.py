@@ -0,0 +1,571 @@
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from tfhe import *
+
+
+# A Netlist is a circuit flattened into a DAG of gates over numbered wires.
+# Each gate is a tuple (operation, output, inputs), where operation is the
+# name of a TFHE gate without the "boots" prefix and output and inputs are
+# indices into self.wires. The one exception is CONSTANT, whose inputs are
+# the plaintext (value,) instead of wires.
+# Wires that no gate outputs are inputs to the netlist (registers, ROM,
+# TRUE and FALSE) and have to be set before evaluating it. Outputs are the
+# wires that are read after evaluating it; if they aren't given, every
+# gate output counts as one.
+
+TABLES = {
+    "NAND": lambda a, b: not (a and b),
+    "OR": lambda a, b: a or b,
+    "AND": lambda a, b: a and b,
+    "XOR": lambda a, b: a != b,
+    "XNOR": lambda a, b: a == b,
+    "NOR": lambda a, b: not (a or b),
+    "ANDNY": lambda a, b: not a and b,
+    "ANDYN": lambda a, b: a and not b,
+    "ORNY": lambda a, b: not a or b,
+    "ORYN": lambda a, b: a or not b,
+}
+
+# These gates are linear operations on the ciphertext and don't bootstrap
+UNBOOTSTRAPPED = {"CONSTANT", "COPY", "NOT"}
+
+# The number of bootstraps of every gate: bootsMUX bootstraps twice
+# (but only key switches once)
+BOOTSTRAPS = dict({operation: 1 for operation in TABLES}, CONSTANT=0, COPY=0, NOT=0, MUX=2)
+
+COMMUTATIVE = {"NAND", "OR", "AND", "XOR", "XNOR", "NOR"}
+
+# The cost of every gate for map_technology, by default in bootstraps.
+# measure_costs measures the real ones on this host.
+COSTS = dict(BOOTSTRAPS)
+
+
+def truth_table(table):
+    return tuple(bool(table(a, b)) for a in (False, True) for b in (False, True))
+
+
+# Every two input gate that depends on both of its inputs is in TABLES,
+# so negating an input or the output of one gives another one.
+OPERATIONS = {truth_table(table): operation for operation, table in TABLES.items()}
+
+
+def negate_input(operation, position):
+    table = TABLES[operation]
+    if position == 0:
+        return OPERATIONS[truth_table(lambda a, b: table(not a, b))]
+    return OPERATIONS[truth_table(lambda a, b: table(a, not b))]
+
+
+def negate_output(operation):
+    table = TABLES[operation]
+    return OPERATIONS[truth_table(lambda a, b: not table(a, b))]
+
+
+def gate_key(operation, inputs):
+    return operation, (tuple(sorted(inputs)) if operation in COMMUTATIVE else tuple(inputs))
+
+
+# The rows of the truth table of a gate where its output is 1, for BLIF
+def cover(operation, inputs):
+    if operation == "CONSTANT":
+        return ["1"] if inputs[0] else []
+    if operation == "NOT":
+        return ["0 1"]
+    if operation == "COPY":
+        return ["1 1"]
+    if operation == "MUX":
+        return ["11- 1", "0-1 1"]
+    table = TABLES[operation]
+    return ["%d%d 1" % (a, b) for a in (0, 1) for b in (0, 1) if table(a, b)]
+
+
+# Time every gate on this host, in seconds per gate (the fastest of `repeats`)
+def measure_costs(cloud_key, gate_params, repeats=10):
+    samples = [create_ciphertext(gate_params) for i in range(4)]
+    for sample in samples:
+        tfhe.bootsCONSTANT(sample, 0, cloud_key)
+    costs = {}
+    for operation in COSTS:
+        function = getattr(tfhe, "boots" + operation)
+        if operation == "CONSTANT":
+            arguments = (0,)
+        else:
+            arguments = samples[1:{"NOT": 2, "COPY": 2, "MUX": 4}.get(operation, 3)]
+        times = []
+        for repeat in range(repeats):
+            start = time.perf_counter()
+            function(samples[0], *arguments, cloud_key)
+            times.append(time.perf_counter() - start)
+        costs[operation] = min(times)
+    for sample in samples:
+        delete_ciphertext(sample)
+    return costs
+
+
+# Reduce a gate with one free input x to a constant, a copy of x or its negation.
+def reduce(table, x):
+    low, high = bool(table(False)), bool(table(True))
+    if low == high:
+        return "CONSTANT", (int(low),)
+    return ("COPY" if high else "NOT"), (x,)
+
+
+# Simplify a gate given the values of the wires that are known to be constant
+def simplify(operation, inputs, values):
+    if operation == "CONSTANT":
+        return operation, inputs
+    known = [values.get(wire) for wire in inputs]
+    if operation in ("COPY", "NOT"):
+        if known[0] is None:
+            return operation, inputs
+        return "CONSTANT", (int(known[0] == (operation == "COPY")),)
+    if operation == "MUX":
+        condition, a, b = inputs
+        if known[0] is not None:
+            chosen = a if known[0] else b
+            return simplify("COPY", (chosen,), values)
+        if a == b:
+            return simplify("COPY", (a,), values)
+        if known[1] is not None and known[2] is not None:
+            return reduce(lambda c: known[1] if c else known[2], condition)
+        if known[1] is not None:
+            return ("OR" if known[1] else "ANDNY"), (condition, b)
+        if known[2] is not None:
+            return ("ORNY" if known[2] else "AND"), (condition, a)
+        return operation, inputs
+    table = TABLES[operation]
+    a, b = inputs
+    if known[0] is not None and known[1] is not None:
+        return "CONSTANT", (int(bool(table(known[0], known[1]))),)
+    if known[0] is not None:
+        return reduce(lambda x: table(known[0], x), b)
+    if known[1] is not None:
+        return reduce(lambda x: table(x, known[1]), a)
+    if a == b:
+        return reduce(lambda x: table(x, x), a)
+    return operation, inputs
+
+
+class Netlist:
+    def __init__(self, circuit, outputs=None):
+        self.wires = []
+        self.addresses = {}
+        self.gates = []
+        self.names = {}
+        seen = set()
+        for path, gate in circuit.flatten():
+            if id(gate) in seen:
+                continue
+            seen.add(id(gate))
+            operation = gate.apply.__name__[len("boots"):]
+            if operation == "CONSTANT":
+                inputs = tuple(gate.inputs)
+            else:
+                inputs = tuple(self.wire(sample) for sample in gate.inputs)
+            self.gates.append((operation, self.wire(gate.value), inputs))
+            self.names[self.gates[-1][1]] = path
+        if outputs is None:
+            self.outputs = {output for _, output, _ in self.gates}
+        else:
+            self.outputs = {self.wire(sample) for sample in outputs}
+        self.levels = self.levelize()
+        self.registers = []
+
+    # Declare that the state ciphertexts take the values of the next
+    # ciphertexts after every evaluation (see Register)
+    def register(self, state, next):
+        register = Register(self, state, next)
+        claimed = {wire for other in self.registers for wire in other.state + other.next}
+        produced = self.producers()
+        for wire in register.state:
+            if wire in produced or wire in claimed:
+                raise ValueError("register state has to be a free input of the netlist")
+        for wire in register.next:
+            if wire not in produced or wire in claimed or wire not in self.outputs:
+                raise ValueError("register next value has to be a distinct output of the netlist")
+        if len(set(register.state + register.next)) != len(register.state) * 2:
+            raise ValueError("register wires have to be distinct")
+        self.registers.append(register)
+        return register
+
+    def commit(self):
+        for register in self.registers:
+            register.swap()
+
+    def wire(self, ciphertext):
+        address = get_ciphertext_address(ciphertext)
+        if address not in self.addresses:
+            self.addresses[address] = len(self.wires)
+            self.wires.append(ciphertext)
+        return self.addresses[address]
+
+    def producers(self):
+        return {output: index for index, (_, output, _) in enumerate(self.gates)}
+
+    def dependencies(self, index):
+        operation, output, inputs = self.gates[index]
+        return () if operation == "CONSTANT" else inputs
+
+    # Group the gates into levels such that every gate only depends on
+    # gates in earlier levels, so each level can be evaluated in parallel.
+    def levelize(self):
+        producers = self.producers()
+        consumers = [[] for gate in self.gates]
+        pending = [0] * len(self.gates)
+        for index in range(len(self.gates)):
+            for wire in set(self.dependencies(index)):
+                if wire in producers:
+                    consumers[producers[wire]].append(index)
+                    pending[index] += 1
+
+        levels = []
+        level = [index for index in range(len(self.gates)) if pending[index] == 0]
+        while level:
+            levels.append(level)
+            following = []
+            for index in level:
+                for consumer in consumers[index]:
+                    pending[consumer] -= 1
+                    if pending[consumer] == 0:
+                        following.append(consumer)
+            level = following
+
+        if sum(map(len, levels)) != len(self.gates):
+            raise ValueError("netlist has a combinational cycle")
+        return levels
+
+    def depth(self):
+        return len(self.levels)
+
+    # The path of attribute names from the circuit to the gate
+    def name(self, index):
+        return self.names.get(self.gates[index][1], ())
+
+    # The heaviest path through the netlist and its weight, where each gate
+    # weighs weights[index] (by default the number of times it bootstraps)
+    def critical_path(self, weights=None):
+        if weights is None:
+            weights = [BOOTSTRAPS[operation] for operation, _, _ in self.gates]
+        producers = self.producers()
+        lengths, previous = {}, {}
+        for index in self.order():
+            inputs = [producers[wire] for wire in self.dependencies(index) if wire in producers]
+            longest = max(inputs, key=lengths.get, default=None)
+            lengths[index] = weights[index] + (0 if longest is None else lengths[longest])
+            previous[index] = longest
+        index = max(lengths, key=lengths.get, default=None)
+        path = []
+        while index is not None:
+            path.append(index)
+            index = previous[index]
+        return (lengths[path[0]] if path else 0), path[::-1]
+
+    def bootstraps(self):
+        return sum(BOOTSTRAPS[operation] for operation, _, _ in self.gates)
+
+    def order(self):
+        return [index for level in self.levels for index in level]
+
+    # Rewrite every gate with a constant input into a constant, a copy or a
+    # negation, which don't need bootstrapping. Gates that read a constant
+    # or a copy are rewired to the constant or the original wire instead,
+    # and gates whose outputs aren't needed anymore are removed.
+    # `true` and `false` are the ciphertexts that always hold 1 and 0.
+    def propagate_constants(self, true, false):
+        values = {self.wire(true): True, self.wire(false): False}
+        replacements = {value: wire for wire, value in values.items()}
+        sources = {}
+        for index in self.order():
+            operation, output, inputs = self.gates[index]
+            if operation != "CONSTANT":
+                inputs = tuple(sources.get(wire, wire) for wire in inputs)
+            operation, inputs = simplify(operation, inputs, values)
+            if operation == "CONSTANT":
+                values[output] = bool(inputs[0])
+                if values[output] in replacements:
+                    sources[output] = replacements[values[output]]
+            elif operation == "COPY":
+                sources[output] = inputs[0]
+                if inputs[0] in values:
+                    values[output] = values[inputs[0]]
+            self.gates[index] = (operation, output, inputs)
+        self.eliminate_dead_gates()
+
+    def cost(self, costs=COSTS):
+        return sum(costs[operation] for operation, _, _ in self.gates)
+
+    # Remap the gates to lower their total cost under `costs`, and return
+    # the cost before and after. Inverters are folded into the gates that
+    # read them or the gate they read, since every two input gate has a
+    # variant with either input or its output negated, and a MUX reads its
+    # condition the other way around instead. A MUX of a wire and its
+    # negation, or of its own condition, is a two input gate. If it costs
+    # less, a MUX is split into OR(AND(c, a), ANDNY(c, b)) over new wires
+    # from `allocate(length)`, reusing those gates where they already exist.
+    # Gates that end up computing the same thing as another are replaced
+    # by copies of it.
+    def map_technology(self, costs=COSTS, allocate=None):
+        before = self.cost(costs)
+        negations, sources, gates = {}, {}, {}
+        for index in self.order():
+            operation, output, inputs = self.gates[index]
+            if operation != "CONSTANT":
+                inputs = tuple(sources.get(wire, wire) for wire in inputs)
+            if operation == "NOT" and inputs[0] in negations:
+                operation, inputs = "COPY", (negations[inputs[0]],)
+            elif operation in TABLES:
+                for position in (0, 1):
+                    if inputs[position] in negations:
+                        operation = negate_input(operation, position)
+                        inputs = inputs[:position] + (negations[inputs[position]],) + inputs[position + 1:]
+                operation, inputs = simplify(operation, inputs, {})
+            elif operation == "MUX":
+                operation, inputs = self.map_mux(output, inputs, negations, gates, costs, allocate)
+
+            if operation not in ("CONSTANT", "COPY"):
+                key = gate_key(operation, inputs)
+                if key in gates:
+                    operation, inputs = "COPY", (gates[key],)
+                else:
+                    gates[key] = output
+            if operation == "COPY":
+                sources[output] = inputs[0]
+            elif operation == "NOT":
+                negations[output] = inputs[0]
+            self.gates[index] = (operation, output, inputs)
+        self.levels = self.levelize()
+        self.eliminate_dead_gates()
+
+        producers = self.producers()
+        readers = Counter(wire for index in range(len(self.gates)) for wire in self.dependencies(index))
+        folded = set()
+        for index, (operation, output, inputs) in enumerate(self.gates):
+            if operation != "NOT" or inputs[0] in self.outputs or readers[inputs[0]] != 1:
+                continue
+            source = producers.get(inputs[0])
+            if source is not None and self.gates[source][0] in TABLES:
+                negated, _, source_inputs = self.gates[source]
+                self.gates[source] = (negate_output(negated), output, source_inputs)
+                folded.add(index)
+        self.gates = [gate for index, gate in enumerate(self.gates) if index not in folded]
+        self.levels = self.levelize()
+        return before, self.cost(costs)
+
+    def map_mux(self, output, inputs, negations, gates, costs, allocate):
+        condition, a, b = inputs
+        if condition in negations:
+            condition, a, b = negations[condition], b, a
+        if negations.get(a) == b:
+            return "XOR", (condition, b)
+        if negations.get(b) == a:
+            return "XNOR", (condition, a)
+        if a == condition:
+            return "OR", (condition, b)
+        if b == condition:
+            return "AND", (condition, a)
+        if a == b:
+            return "COPY", (a,)
+        if allocate is None:
+            return "MUX", (condition, a, b)
+        parts = [gate_key("AND", (condition, a)), gate_key("ANDNY", (condition, b))]
+        missing = [part for part in parts if part not in gates]
+        if costs["OR"] + sum(costs[operation] for operation, _ in missing) >= costs["MUX"]:
+            return "MUX", (condition, a, b)
+        for (operation, part_inputs), sample in zip(missing, allocate(len(missing))):
+            wire = self.wire(sample)
+            self.gates.append((operation, wire, part_inputs))
+            self.names[wire] = self.names.get(output, ())
+            gates[operation, part_inputs] = wire
+        return "OR", (gates[parts[0]], gates[parts[1]])
+
+    # Assign the given wires to as few ciphertexts ("slots") as they need,
+    # the way a register allocator would. Outputs, registers and wires that
+    # no gate writes keep a slot of their own. Every other wire takes over
+    # the slot of a wire that was last read in an earlier level, so the
+    # gates of a level, which may run at the same time, never share one.
+    # Returns the slot of every wire.
+    def allocate_slots(self, wires):
+        produced = self.producers()
+        kept = set(self.outputs)
+        for register in self.registers:
+            kept.update(register.state + register.next)
+        last = {}
+        for depth, level in enumerate(self.levels):
+            for index in level:
+                for wire in self.dependencies(index):
+                    last[wire] = depth
+        slots = {}
+        for wire in wires:
+            if wire not in produced or wire in kept:
+                slots[wire] = len(slots)
+        count = len(slots)
+        free, released = [], {}
+        for depth, level in enumerate(self.levels):
+            free.extend(released.pop(depth - 1, []))
+            for index in level:
+                output = self.gates[index][1]
+                if output in slots:
+                    continue
+                if free:
+                    slots[output] = free.pop()
+                else:
+                    slots[output] = count
+                    count += 1
+                released.setdefault(last.get(output, depth), []).append(slots[output])
+        return slots
+
+    # Describe the netlist as plain lists, numbers and strings that can be
+    # saved as JSON, with the wires it uses renumbered from 0 along with
+    # their slots (see allocate_slots). `buses` maps names to lists of buses
+    # that are described by their wires as well, so that they can be found
+    # again in a netlist loaded from the description.
+    def describe(self, buses):
+        buses = {name: [[self.wire(sample) for sample in bus] for bus in value] for name, value in buses.items()}
+        used = set(self.outputs)
+        for index, (operation, output, inputs) in enumerate(self.gates):
+            used.add(output)
+            used.update(self.dependencies(index))
+        for register in self.registers:
+            used.update(register.state + register.next)
+        for value in buses.values():
+            for bus in value:
+                used.update(bus)
+        number = {wire: i for i, wire in enumerate(sorted(used))}
+        slots = self.allocate_slots(sorted(used))
+        gates = []
+        for index, (operation, output, inputs) in enumerate(self.gates):
+            inputs = list(inputs) if operation == "CONSTANT" else [number[wire] for wire in inputs]
+            gates.append([operation, number[output], inputs])
+        return {
+            "wires": len(number),
+            "slots": [slots[wire] for wire in sorted(used)],
+            "gates": gates,
+            "outputs": sorted(number[wire] for wire in self.outputs),
+            "names": [[number[wire], list(path)] for wire, path in self.names.items() if wire in number],
+            "registers": [[[number[wire] for wire in register.state], [number[wire] for wire in register.next]]
+                          for register in self.registers],
+            "buses": {name: [[number[wire] for wire in bus] for bus in value] for name, value in buses.items()},
+        }
+
+    # Load a netlist from its description, over the ciphertexts in `wires`.
+    # Wires that share a slot share a ciphertext, so only the outputs,
+    # registers and inputs can be looked up by their ciphertexts.
+    @classmethod
+    def load(cls, description, wires):
+        netlist = cls.__new__(cls)
+        netlist.wires = list(wires)
+        netlist.addresses = {get_ciphertext_address(sample): wire for wire, sample in enumerate(wires)}
+        netlist.gates = [(operation, output, tuple(inputs)) for operation, output, inputs in description["gates"]]
+        netlist.names = {wire: tuple(path) for wire, path in description["names"]}
+        netlist.outputs = set(description["outputs"])
+        netlist.levels = netlist.levelize()
+        netlist.registers = []
+        for state, next in description["registers"]:
+            netlist.register([wires[wire] for wire in state], [wires[wire] for wire in next])
+        return netlist
+
+    # Write the netlist in the Berkeley Logic Interchange Format, with every
+    # wire named w<index>, the registers as latches and the path of the
+    # circuit of every gate in a comment
+    def write_blif(self, path, model="netlist"):
+        produced = self.producers()
+        states = {wire for register in self.registers for wire in register.state}
+        read = {wire for index in range(len(self.gates)) for wire in self.dependencies(index)}
+        inputs = sorted((read | self.outputs) - set(produced) - states)
+        with open(path, "w") as file:
+            file.write(".model %s\n" % model)
+            file.write(".inputs %s\n" % " ".join("w%d" % wire for wire in inputs))
+            file.write(".outputs %s\n" % " ".join("w%d" % wire for wire in sorted(self.outputs)))
+            for register in self.registers:
+                for state, next in zip(register.state, register.next):
+                    file.write(".latch w%d w%d 3\n" % (next, state))
+            for index in self.order():
+                operation, output, inputs = self.gates[index]
+                file.write("# %s %s\n" % (operation, ".".join(self.name(index))))
+                wires = [output] if operation == "CONSTANT" else list(inputs) + [output]
+                file.write(".names %s\n" % " ".join("w%d" % wire for wire in wires))
+                for row in cover(operation, inputs):
+                    file.write(row + "\n")
+            file.write(".end\n")
+
+    def eliminate_dead_gates(self):
+        live = set(self.outputs)
+        gates = []
+        for index in reversed(self.order()):
+            operation, output, inputs = self.gates[index]
+            if output in live:
+                gates.append(self.gates[index])
+                live.update(self.dependencies(index))
+        self.gates = gates[::-1]
+        self.levels = self.levelize()
+
+
+# A Register is double buffered: rather than copying the next value into
+# the state at the end of a cycle, the buffers of the state and next wires
+# are swapped, so the state holds the new value and the next cycle
+# overwrites the old one.
+
+
+class Register:
+    def __init__(self, netlist, state, next):
+        self.netlist = netlist
+        self.state = [netlist.wire(sample) for sample in state]
+        self.next = [netlist.wire(sample) for sample in next]
+
+    def swap(self):
+        wires = self.netlist.wires
+        for state, next in zip(self.state, self.next):
+            wires[state], wires[next] = wires[next], wires[state]
+
+    def value(self):
+        return [self.netlist.wires[wire] for wire in self.state]
+
+
+# libtfhe isn't thread safe: its FFT processors are globals with scratch
+# buffers that every bootstrap shares, so concurrent gates can corrupt each
+# other. Only the plaintext backend can run the gates of a level on several
+# threads; use a SharedExecutor, which runs them in processes, otherwise.
+
+
+class Executor:
+    def __init__(self, netlist, workers=1):
+        if workers > 1 and not PLAINTEXT:
+            raise ValueError("libtfhe isn't thread safe, so use processes instead of workers")
+        self.netlist = netlist
+        self.workers = workers
+        self.functions = {}
+        for operation, output, inputs in netlist.gates:
+            self.functions[operation] = getattr(tfhe, "boots" + operation)
+        self.pool = ThreadPoolExecutor(workers) if workers > 1 else None
+
+    def apply(self, index, cloud_key):
+        operation, output, inputs = self.netlist.gates[index]
+        wires = self.netlist.wires
+        if operation == "CONSTANT":
+            arguments = inputs
+        else:
+            arguments = [wires[wire] for wire in inputs]
+        self.functions[operation](wires[output], *arguments, cloud_key)
+
+    # With workers, the gates within a level run on the pool
+    def eval(self, cloud_key):
+        for level in self.netlist.levels:
+            if self.pool is None or len(level) == 1:
+                for index in level:
+                    self.apply(index, cloud_key)
+            else:
+                list(self.pool.map(lambda index: self.apply(index, cloud_key), level))
+
+    # Evaluate `cycles` cycles, committing the registers between them but
+    # not after the last one, which is up to the caller
+    def run(self, cloud_key, cycles):
+        for cycle in range(cycles):
+            if cycle > 0:
+                self.netlist.commit()
+            self.eval(cloud_key)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
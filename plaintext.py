@@ -0,0 +1,217 @@
+import pickle
+import numpy as np
+from tfhe_utils import OPCODES
+
+
+# A plaintext stand-in for the TFHE library, with the same function names
+# as the ctypes bindings in tfhe_utils.py. A "ciphertext" is a bitsliced
+# vector of uint64 words holding one bit per lane, so every gate evaluates
+# `lanes` independent test vectors at once with a single NumPy operation.
+
+WORD = 64
+
+
+class GateParams:
+    def __init__(self, minimum_lambda):
+        self.minimum_lambda = minimum_lambda
+
+
+class CloudKeySet:
+    def __init__(self, params):
+        self.params = params
+
+
+class SecretKeySet:
+    def __init__(self, params):
+        self.params = params
+        self.cloud = CloudKeySet(params)
+
+
+class Library:
+    def __init__(self, lanes):
+        self.lanes = lanes
+        self.words = -(-lanes // WORD)
+
+    def pack_bits(self, bits):
+        bits = np.broadcast_to(np.asarray(bits, dtype=bool), (self.lanes,))
+        padded = np.zeros(self.words * WORD, dtype=bool)
+        padded[:self.lanes] = bits
+        return np.packbits(padded, bitorder="little").view(np.uint64)
+
+    def unpack_bits(self, words):
+        bits = np.unpackbits(words.view(np.uint8), bitorder="little")
+        return bits[:self.lanes].astype(bool)
+
+    def pack_ciphertext(self, sample):
+        return sample.tobytes()
+
+    def pack_ciphertext_into(self, buffer, sample):
+        np.frombuffer(buffer, dtype=np.uint64, count=self.words)[...] = sample
+
+    def unpack_ciphertext(self, buffer, sample):
+        sample[...] = np.frombuffer(buffer, dtype=np.uint64, count=self.words)
+
+    # Parameters and keysets
+
+    def new_default_gate_bootstrapping_parameters(self, minimum_lambda):
+        return GateParams(minimum_lambda)
+
+    def delete_gate_bootstrapping_parameters(self, params):
+        pass
+
+    def new_random_gate_bootstrapping_secret_keyset(self, params):
+        return SecretKeySet(params)
+
+    def delete_gate_bootstrapping_secret_keyset(self, keyset):
+        pass
+
+    def delete_gate_bootstrapping_cloud_keyset(self, keyset):
+        pass
+
+    # Ciphertexts
+
+    def new_gate_bootstrapping_ciphertext(self, params):
+        return np.zeros(self.words, dtype=np.uint64)
+
+    def delete_gate_bootstrapping_ciphertext(self, sample):
+        pass
+
+    def new_gate_bootstrapping_ciphertext_array(self, nbsamples, params):
+        return np.zeros((nbsamples, self.words), dtype=np.uint64)
+
+    def delete_gate_bootstrapping_ciphertext_array(self, nbsamples, samples):
+        pass
+
+    # `message` is either one bit for every lane or a sequence of per-lane bits.
+    def bootsSymEncrypt(self, result, message, key):
+        result[...] = self.pack_bits(message)
+
+    # Returns a bool when there is a single lane and an array of bools otherwise.
+    def bootsSymDecrypt(self, sample, key):
+        bits = self.unpack_bits(sample)
+        return bool(bits[0]) if self.lanes == 1 else bits
+
+    # Gates
+
+    def bootsCONSTANT(self, result, value, bk):
+        result[...] = ~np.uint64(0) if value else np.uint64(0)
+
+    def bootsNOT(self, result, ca, bk):
+        np.invert(ca, out=result)
+
+    def bootsCOPY(self, result, ca, bk):
+        np.copyto(result, ca)
+
+    def bootsNAND(self, result, ca, cb, bk):
+        np.invert(ca & cb, out=result)
+
+    def bootsOR(self, result, ca, cb, bk):
+        np.bitwise_or(ca, cb, out=result)
+
+    def bootsAND(self, result, ca, cb, bk):
+        np.bitwise_and(ca, cb, out=result)
+
+    def bootsXOR(self, result, ca, cb, bk):
+        np.bitwise_xor(ca, cb, out=result)
+
+    def bootsXNOR(self, result, ca, cb, bk):
+        np.invert(ca ^ cb, out=result)
+
+    def bootsNOR(self, result, ca, cb, bk):
+        np.invert(ca | cb, out=result)
+
+    def bootsANDNY(self, result, ca, cb, bk):
+        np.bitwise_and(~ca, cb, out=result)
+
+    def bootsANDYN(self, result, ca, cb, bk):
+        np.bitwise_and(ca, ~cb, out=result)
+
+    def bootsORNY(self, result, ca, cb, bk):
+        np.bitwise_or(~ca, cb, out=result)
+
+    def bootsORYN(self, result, ca, cb, bk):
+        np.bitwise_or(ca, ~cb, out=result)
+
+    def bootsMUX(self, result, ca, cb, cc, bk):
+        np.bitwise_or(ca & cb, ~ca & cc, out=result)
+
+
+# Stand-in for the tfhe_io.so file wrappers
+
+class IO:
+    def __init__(self, lanes, library):
+        self.lanes = lanes
+        self.library = library
+
+    def export_gate_params(self, filename, params):
+        with open(filename, "wb") as file:
+            pickle.dump(params, file)
+
+    def import_gate_params(self, filename):
+        with open(filename, "rb") as file:
+            return pickle.load(file)
+
+    def export_secret_keyset(self, filename, keyset):
+        self.export_gate_params(filename, keyset)
+
+    def import_secret_keyset(self, filename):
+        return self.import_gate_params(filename)
+
+    def export_cloud_keyset(self, filename, keyset):
+        self.export_gate_params(filename, keyset)
+
+    def import_cloud_keyset(self, filename):
+        return self.import_gate_params(filename)
+
+    def export_ciphertext(self, filename, sample, params):
+        with open(filename, "wb") as file:
+            file.write(sample.tobytes())
+
+    def import_ciphertext(self, filename, sample, params):
+        with open(filename, "rb") as file:
+            sample[...] = np.frombuffer(file.read(), dtype=np.uint64)
+
+    def export_gate_params_to_buffer(self, params):
+        return memoryview(pickle.dumps(params))
+
+    def import_gate_params_from_buffer(self, buffer):
+        return pickle.loads(buffer)
+
+    def export_secret_keyset_to_buffer(self, keyset):
+        return memoryview(pickle.dumps(keyset))
+
+    def import_secret_keyset_from_buffer(self, buffer):
+        return pickle.loads(buffer)
+
+    def export_cloud_keyset_to_buffer(self, keyset):
+        return memoryview(pickle.dumps(keyset))
+
+    def import_cloud_keyset_from_buffer(self, buffer):
+        return pickle.loads(buffer)
+
+    def export_ciphertext_to_buffer(self, sample, params):
+        return memoryview(sample.tobytes())
+
+    def import_ciphertext_from_buffer(self, buffer, sample, params):
+        sample[...] = np.frombuffer(buffer, dtype=np.uint64, count=sample.size)
+
+    # The same as run_netlist in tfhe_io.c
+    def run_netlist(self, wires, opcodes, operands, swaps, cycles, bk):
+        wires = list(wires)
+        functions = [getattr(self.library, "boots" + operation) for operation in OPCODES]
+        arities = [{"CONSTANT": 0, "NOT": 1, "COPY": 1, "MUX": 3}.get(operation, 2) for operation in OPCODES]
+        for cycle in range(cycles):
+            if cycle > 0:
+                for i in range(0, len(swaps), 2):
+                    wires[swaps[i]], wires[swaps[i + 1]] = wires[swaps[i + 1]], wires[swaps[i]]
+            for i, opcode in enumerate(opcodes):
+                output, *inputs = operands[4 * i:4 * i + 4]
+                if arities[opcode]:
+                    functions[opcode](wires[output], *[wires[wire] for wire in inputs[:arities[opcode]]], bk)
+                else:
+                    functions[opcode](wires[output], inputs[0], bk)
+
+
+def initialize(architecture, lanes=1):
+    library = Library(lanes)
+    return library, IO(lanes, library)
@@ -0,0 +1,67 @@
+import json
+import time
+from netlist import *
+
+
+# A ProfilingExecutor times every gate it evaluates, and after every cycle
+# attributes the gates, bootstraps and seconds to each named sub-circuit
+# (like "cpu.nest" or "ram.elements[5]") along with the critical path.
+# write() saves the reports as JSON, and the time of every gate in the
+# folded stack format that flamegraph.pl and speedscope read.
+
+
+class ProfilingExecutor(Executor):
+    def __init__(self, netlist, workers=1):
+        Executor.__init__(self, netlist, workers)
+        self.times = [0.0] * len(netlist.gates)
+        self.totals = [0.0] * len(netlist.gates)
+        self.reports = []
+
+    def apply(self, index, cloud_key):
+        start = time.perf_counter()
+        Executor.apply(self, index, cloud_key)
+        self.times[index] = time.perf_counter() - start
+
+    def eval(self, cloud_key):
+        start = time.perf_counter()
+        Executor.eval(self, cloud_key)
+        seconds = time.perf_counter() - start
+        self.totals = [total + gate for total, gate in zip(self.totals, self.times)]
+        self.reports.append(self.report(seconds))
+
+    def report(self, seconds):
+        netlist = self.netlist
+        circuits = {}
+        for index, (operation, output, inputs) in enumerate(netlist.gates):
+            path = netlist.name(index)
+            for depth in range(len(path)):
+                name = ".".join(path[:depth]) or "Computer"
+                circuit = circuits.setdefault(name, {"gates": 0, "bootstraps": 0, "seconds": 0.0})
+                circuit["gates"] += 1
+                circuit["bootstraps"] += BOOTSTRAPS[operation]
+                circuit["seconds"] += self.times[index]
+
+        bootstraps, path = netlist.critical_path()
+        critical_seconds, _ = netlist.critical_path(self.times)
+        return {
+            "cycle": len(self.reports),
+            "seconds": seconds,
+            "gates": len(netlist.gates),
+            "bootstraps": netlist.bootstraps(),
+            "levels": netlist.depth(),
+            "critical_path": {
+                "bootstraps": bootstraps,
+                "seconds": critical_seconds,
+                "gates": [".".join(netlist.name(index)) for index in path],
+            },
+            "circuits": circuits,
+        }
+
+    # Write the reports to path and the folded stacks to path + ".folded"
+    def write(self, path):
+        with open(path, "w") as file:
+            json.dump(self.reports, file, indent=2)
+        with open(path + ".folded", "w") as file:
+            for index, total in enumerate(self.totals):
+                stack = ";".join(("Computer",) + self.netlist.name(index))
+                file.write("%s %d\n" % (stack, round(total * 1e6)))
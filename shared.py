@@ -0,0 +1,170 @@
+import multiprocessing
+import threading
+from multiprocessing import shared_memory
+from netlist import *
+
+
+# A SharedExecutor evaluates a netlist on several local worker processes.
+# Every wire has a slot in a block of shared memory that holds its packed
+# ciphertext (see pack_ciphertext). Each worker keeps its own ciphertexts
+# and only goes through shared memory for the wires it exchanges with the
+# other workers or with the parent, and the workers only wait for each
+# other after the levels where they do.
+# The workers get the cloud keyset of the first eval and keep it.
+
+
+# Assign the gates of every level to processes, balancing the bootstraps.
+# Gates that don't bootstrap follow the process of their first input.
+def partition(netlist, processes):
+    producers = netlist.producers()
+    owners = {}
+    for level in netlist.levels:
+        load = [0] * processes
+        for index in level:
+            operation, output, inputs = netlist.gates[index]
+            sources = [owners[producers[wire]] for wire in netlist.dependencies(index) if wire in producers]
+            if operation in UNBOOTSTRAPPED and sources:
+                owner = sources[0]
+            else:
+                owner = min(range(processes), key=load.__getitem__)
+                load[owner] += BOOTSTRAPS[operation]
+            owners[index] = owner
+    return owners
+
+
+# For every process and level: the wires to load from shared memory,
+# the gates to evaluate and the wires to store to shared memory.
+# Also whether the processes have to wait for each other after each level.
+def plan(netlist, processes):
+    owners = partition(netlist, processes)
+    producers = netlist.producers()
+    plans = [[] for process in range(processes)]
+    loaded = [set() for process in range(processes)]
+    exchanged = set(netlist.outputs)
+    for index, owner in owners.items():
+        for wire in netlist.dependencies(index):
+            if wire not in producers or owners[producers[wire]] != owner:
+                exchanged.add(wire)
+
+    barriers = []
+    for level in netlist.levels:
+        steps = [([], [], []) for process in range(processes)]
+        for index in level:
+            loads, gates, stores = steps[owners[index]]
+            for wire in netlist.dependencies(index):
+                if wire in exchanged and wire not in loaded[owners[index]]:
+                    if wire not in producers or owners[producers[wire]] != owners[index]:
+                        loaded[owners[index]].add(wire)
+                        loads.append(wire)
+            gates.append(index)
+            output = netlist.gates[index][1]
+            if output in exchanged:
+                stores.append(output)
+        for process in range(processes):
+            plans[process].append(steps[process])
+        barriers.append(any(step[2] for step in steps))
+    return plans, barriers
+
+
+def work(gates, steps, barriers, name, size, gate_params_buffer, cloud_keyset_buffer, cycle, level_barrier, stop):
+    memory = shared_memory.SharedMemory(name=name)
+    try:
+        gate_params = import_gate_params_from_buffer(gate_params_buffer)
+        cloud_keyset = import_cloud_keyset_from_buffer(cloud_keyset_buffer)
+        wires = set()
+        for loads, indices, stores in steps:
+            wires.update(loads)
+            for index in indices:
+                operation, output, inputs = gates[index]
+                wires.add(output)
+                if operation != "CONSTANT":
+                    wires.update(inputs)
+        array = create_ciphertext_array(max(len(wires), 1), gate_params)
+        samples = {wire: get_ciphertext(array, i) for i, wire in enumerate(sorted(wires))}
+        functions = {operation: getattr(tfhe, "boots" + operation) for operation, _, _ in gates}
+
+        while True:
+            cycle.wait()
+            if stop.value:
+                break
+            for (loads, indices, stores), barrier in zip(steps, barriers):
+                for wire in loads:
+                    unpack_ciphertext(memory.buf[wire * size:(wire + 1) * size], samples[wire], gate_params)
+                for index in indices:
+                    operation, output, inputs = gates[index]
+                    arguments = inputs if operation == "CONSTANT" else [samples[wire] for wire in inputs]
+                    functions[operation](samples[output], *arguments, cloud_keyset)
+                for wire in stores:
+                    memory.buf[wire * size:(wire + 1) * size] = pack_ciphertext(samples[wire], gate_params)
+                if barrier:
+                    level_barrier.wait()
+            cycle.wait()
+    except BaseException:
+        cycle.abort()
+        level_barrier.abort()
+        raise
+    finally:
+        memory.close()
+
+
+class SharedExecutor:
+    def __init__(self, netlist, processes, gate_params):
+        self.netlist = netlist
+        self.processes = processes
+        self.gate_params = gate_params
+        self.size = get_ciphertext_size(gate_params)
+        producers = netlist.producers()
+        self.inputs = sorted({wire for index in range(len(netlist.gates)) for wire in netlist.dependencies(index)} - set(producers))
+        self.outputs = sorted(wire for wire in netlist.outputs if wire in producers)
+        self.workers = None
+
+    def start(self, cloud_key):
+        context = multiprocessing.get_context()
+        self.memory = shared_memory.SharedMemory(create=True, size=max(len(self.netlist.wires) * self.size, 1))
+        self.cycle = context.Barrier(self.processes + 1)
+        self.level_barrier = context.Barrier(self.processes)
+        self.stop = context.Value("b", 0)
+        plans, barriers = plan(self.netlist, self.processes)
+        gate_params_buffer = bytes(export_gate_params_to_buffer(self.gate_params))
+        cloud_keyset_buffer = bytes(export_cloud_keyset_to_buffer(cloud_key))
+        self.workers = []
+        for steps in plans:
+            arguments = (self.netlist.gates, steps, barriers, self.memory.name, self.size,
+                         gate_params_buffer, cloud_keyset_buffer, self.cycle, self.level_barrier, self.stop)
+            worker = context.Process(target=work, args=arguments, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def eval(self, cloud_key):
+        if self.workers is None:
+            self.start(cloud_key)
+        wires, buffer, size = self.netlist.wires, self.memory.buf, self.size
+        for wire in self.inputs:
+            buffer[wire * size:(wire + 1) * size] = pack_ciphertext(wires[wire], self.gate_params)
+        try:
+            self.cycle.wait()
+            self.cycle.wait()
+        except threading.BrokenBarrierError:
+            raise RuntimeError("a worker process of the SharedExecutor failed")
+        for wire in self.outputs:
+            unpack_ciphertext(buffer[wire * size:(wire + 1) * size], wires[wire], self.gate_params)
+
+    def run(self, cloud_key, cycles):
+        for cycle in range(cycles):
+            if cycle > 0:
+                self.netlist.commit()
+            self.eval(cloud_key)
+
+    def close(self):
+        if self.workers is None:
+            return
+        self.stop.value = 1
+        try:
+            self.cycle.wait(timeout=10)
+        except threading.BrokenBarrierError:
+            pass
+        for worker in self.workers:
+            worker.join()
+        self.memory.close()
+        self.memory.unlink()
+        self.workers = None
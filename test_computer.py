@@ -0,0 +1,117 @@
+import os
+
+# Every test runs on the plaintext backend with a single lane
+os.environ["TFHE_LIBRARY"] = "plaintext"
+os.environ["TFHE_LANES"] = "1"
+
+import pytest
+from circuits import *
+
+RAM = 4
+BITS = 8
+
+PROGRAMS = [
+    "+++++[-]",
+    "-",
+    "++>+++[<+>-]",
+    "+++[>++<-]>[>+<-]",
+    "++[>++[>+<-]<-]",
+    "+>+>+>+[<]>[>]+",
+    ">>+++<[-]<--[>+<+]",
+]
+
+CONFIGS = {
+    "executor": {},
+    "workers": {"workers": 2},
+    "profile": {"profile": True},
+    "native": {"native": True},
+    "processes": {"processes": 2},
+    "unmapped": {"costs": None},
+    "mapped": {"costs": COSTS},
+    "split": {"costs": dict(COSTS, MUX=10)},
+    "compact": {"compact": True},
+}
+
+secret = create_secret_keyset(GATE_PARAMS)
+cloud = get_cloud_keyset(secret)
+TRUE.eval(cloud)
+FALSE.eval(cloud)
+
+
+def wrap(value, bits):
+    value %= 2 ** bits
+    return value - 2 ** bits if value >> (bits - 1) else value
+
+
+# A reference interpreter with the semantics of a Computer: words and the
+# data pointer wrap around, and cells outside the RAM read 0 and ignore writes
+def interpret(code, ram=RAM, bits=BITS, steps=10000):
+    data = [0] * ram
+    pointer = 0
+    ip = 0
+    jumps, stack = {}, []
+    for i, c in enumerate(code):
+        if c == "[":
+            stack.append(i)
+        elif c == "]":
+            jumps[i] = stack.pop()
+            jumps[jumps[i]] = i
+    for step in range(steps):
+        if ip >= len(code):
+            return data
+        c = code[ip]
+        value = data[pointer] if pointer < ram else 0
+        if c in "+-" and pointer < ram:
+            data[pointer] = wrap(value + (1 if c == "+" else -1), bits)
+        elif c in "<>":
+            pointer = (pointer + (1 if c == ">" else -1)) % 2 ** bits
+        elif c == "[" and value == 0 or c == "]" and value != 0:
+            ip = jumps[ip]
+        ip += 1
+    raise RuntimeError("the program didn't halt")
+
+
+# Run until the instruction pointer is past the end of the program,
+# which it only gets to once the program has halted
+def execute(code, cycles=8, **options):
+    options.setdefault("cache", None)
+    rom = compile_code(code, secret, BITS, options.get("compact", False))
+    with Computer(rom, ram_width=RAM, word_bits=BITS, **options) as computer:
+        computer.init(cloud)
+        while get(computer.instruction_pointer, secret) < len(rom):
+            computer.eval(cloud, cycles)
+            if computer.cycle > 2000:
+                raise RuntimeError("the program didn't halt")
+        return [get(bus, secret) for bus in computer.data]
+
+
+@pytest.mark.parametrize("config", sorted(CONFIGS))
+@pytest.mark.parametrize("code", PROGRAMS)
+def test_computer_matches_interpreter(code, config):
+    assert execute(code, **CONFIGS[config]) == interpret(code)
+
+
+def test_cached_netlist_matches_interpreter(tmp_path):
+    code = PROGRAMS[3]
+    for run in range(2):
+        assert execute(code, cache=str(tmp_path)) == interpret(code)
+    assert len([name for name in os.listdir(tmp_path) if name.endswith(".netlist")]) == 1
+
+
+def test_mapping_keeps_outputs_and_reports_costs():
+    rom = compile_code(PROGRAMS[2], secret, BITS)
+    with Computer(rom, ram_width=RAM, word_bits=BITS, cache=None, costs=dict(COSTS, MUX=10)) as computer:
+        before, after = computer.mapping
+        assert after < before
+        assert computer.netlist.cost(dict(COSTS, MUX=10)) == after
+
+
+def test_sizes_have_to_fit_pointers():
+    with pytest.raises(ValueError):
+        Computer(compile_code("+", secret, 4), ram_width=32, word_bits=4, dp_bits=4, cache=None)
+    with pytest.raises(ValueError):
+        Computer(compile_code("+++++", secret), ip_bits=2, cache=None)
+
+
+def test_empty_rom():
+    assert execute("") == [0] * RAM
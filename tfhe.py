@@ -1,12 +1,19 @@
 from tfhe_utils import *
+from array import array
+import struct
+import weakref
 import tfhe_utils
 
 
-TFHE_LIBRARY = "libtfhe-spqlios-fma.dylib"
+# Set TFHE_LIBRARY=plaintext to simulate every gate on TFHE_LANES plaintext test vectors at once
+TFHE_LIBRARY = os.environ.get("TFHE_LIBRARY", "libtfhe-spqlios-fma.dylib")
+TFHE_LANES = int(os.environ.get("TFHE_LANES", 1))
 MINIMUM_LAMBDA = 100
-ARCHITECTURE = 8
+ARCHITECTURE = int(os.environ.get("TFHE_ARCHITECTURE", 8))
 
-tfhe, tfhe_io = tfhe_utils.initialize(library=TFHE_LIBRARY, architecture=ARCHITECTURE)
+PLAINTEXT = TFHE_LIBRARY == PLAINTEXT_LIBRARY
+
+tfhe, tfhe_io = tfhe_utils.initialize(library=TFHE_LIBRARY, architecture=ARCHITECTURE, lanes=TFHE_LANES)
 
 
 def create_gate_params(minimum_lambda=MINIMUM_LAMBDA):
@@ -33,19 +40,80 @@ def delete_ciphertext(ciphertext):
     return tfhe.delete_gate_bootstrapping_ciphertext(ciphertext)
 
 
-def create_ciphertext_array(gate_params):
-    return tfhe.new_gate_bootstrapping_ciphertext_array(ARCHITECTURE, gate_params)
+def create_ciphertext_array(length, gate_params):
+    return tfhe.new_gate_bootstrapping_ciphertext_array(length, gate_params)
+
+
+def delete_ciphertext_array(length, ciphertext_array):
+    return tfhe.delete_gate_bootstrapping_ciphertext_array(length, ciphertext_array)
+
+
+def get_ciphertext(ciphertext_array, index):
+    if PLAINTEXT:
+        return ciphertext_array[index]
+    return pointer(ciphertext_array[index])
+
+
+def get_ciphertext_address(ciphertext):
+    if PLAINTEXT:
+        return ciphertext.ctypes.data
+    return addressof(ciphertext.contents)
+
+
+def get_ciphertext_addresses(ciphertexts):
+    return array("Q" if sizeof(c_void_p) == 8 else "I", map(get_ciphertext_address, ciphertexts))
+
+
+# Ciphertexts can also be packed into fixed size records of raw bytes,
+# which are the coefficients of a, then b and the current variance.
+SAMPLE_TAIL = struct.Struct("<id")
 
 
-def delete_ciphertext_array(ciphertext):
-    return tfhe.delete_gate_bootstrapping_ciphertext_array(ARCHITECTURE, ciphertext)
+def get_ciphertext_size(gate_params):
+    if PLAINTEXT:
+        return tfhe.words * 8
+    return get_lwe_params(gate_params).contents.n * sizeof(Torus32) + SAMPLE_TAIL.size
+
+
+def pack_ciphertext(ciphertext, gate_params):
+    if PLAINTEXT:
+        return tfhe.pack_ciphertext(ciphertext)
+    n = get_lwe_params(gate_params).contents.n
+    sample = ciphertext.contents
+    return string_at(sample.a, n * sizeof(Torus32)) + SAMPLE_TAIL.pack(sample.b, sample.current_variance)
+
+
+# Packs into a writable buffer of get_ciphertext_size bytes instead of new bytes
+def pack_ciphertext_into(buffer, ciphertext, gate_params):
+    if PLAINTEXT:
+        return tfhe.pack_ciphertext_into(buffer, ciphertext)
+    n = get_lwe_params(gate_params).contents.n
+    sample = ciphertext.contents
+    memmove((c_char * (n * sizeof(Torus32))).from_buffer(buffer), sample.a, n * sizeof(Torus32))
+    SAMPLE_TAIL.pack_into(buffer, n * sizeof(Torus32), sample.b, sample.current_variance)
+
+
+# `buffer` is anything that supports the buffer protocol, like a slice of a memoryview
+def unpack_ciphertext(buffer, ciphertext, gate_params):
+    if PLAINTEXT:
+        return tfhe.unpack_ciphertext(buffer, ciphertext)
+    n = get_lwe_params(gate_params).contents.n
+    sample = ciphertext.contents
+    buffer = memoryview(buffer)
+    a = (Torus32 * n).from_buffer_copy(buffer) if buffer.readonly else (Torus32 * n).from_buffer(buffer)
+    memmove(sample.a, a, n * sizeof(Torus32))
+    sample.b, sample.current_variance = SAMPLE_TAIL.unpack_from(buffer, n * sizeof(Torus32))
 
 
 def get_lwe_params(gate_params):
-    return pointer(gate_params.contents.in_out_params)
+    if PLAINTEXT:
+        return gate_params
+    return gate_params.contents.in_out_params
 
 
 def get_cloud_keyset(secret_keyset):
+    if PLAINTEXT:
+        return secret_keyset.cloud
     return pointer(secret_keyset.contents.cloud)
 
 
@@ -53,14 +121,47 @@ def delete_cloud_keyset(cloud_keyset):
     tfhe.delete_gate_bootstrapping_cloud_keyset(cloud_keyset)
 
 
+# With the plaintext library, value can also be a sequence with one bit per lane,
+# and decrypt returns an array with one bit per lane if there is more than one.
 def encrypt(lwe_sample, value, secret_keyset):
-    tfhe.bootsSymEncrypt(lwe_sample, int(value), secret_keyset)
+    tfhe.bootsSymEncrypt(lwe_sample, value if PLAINTEXT else int(value), secret_keyset)
 
 
 def decrypt(lwe_sample, secret_keyset):
+    if PLAINTEXT:
+        return tfhe.bootsSymDecrypt(lwe_sample, secret_keyset)
     return bool(tfhe.bootsSymDecrypt(lwe_sample, secret_keyset))
 
 
+# Encrypt or decrypt many samples with a single call into tfhe_io.so.
+# Decryption can be split across threads, but encryption can't, since the
+# random number generator of TFHE isn't thread safe. The bits are bools or
+# bytes of 0 and 1, like a NumPy array of bools, and decrypt_bits returns
+# a bytearray of them. With the plaintext library, decrypt_bits returns a
+# NumPy array with a row of lanes for every sample if there is more than one.
+def encrypt_bits(samples, bits, secret_keyset):
+    if PLAINTEXT:
+        for sample, bit in zip(samples, bits):
+            encrypt(sample, bit, secret_keyset)
+        return
+    messages = bytes(bits)
+    if len(messages) != len(samples):
+        raise ValueError("%d bits for %d samples" % (len(messages), len(samples)))
+    addresses = get_ciphertext_addresses(samples)
+    tfhe_io.encrypt_bits(addresses.buffer_info()[0], messages, len(messages), secret_keyset)
+
+
+def decrypt_bits(samples, secret_keyset, threads=1):
+    if PLAINTEXT:
+        import numpy
+        return numpy.array([decrypt(sample, secret_keyset) for sample in samples], dtype=bool)
+    messages = bytearray(len(samples))
+    addresses = get_ciphertext_addresses(samples)
+    tfhe_io.decrypt_bits(addresses.buffer_info()[0], (c_char * len(messages)).from_buffer(messages),
+                         len(messages), threads, secret_keyset)
+    return messages
+
+
 def import_gate_params(path):
     return tfhe_io.import_gate_params(path)
 
@@ -91,3 +192,86 @@ def import_ciphertext(path, ciphertext, gate_params):
 
 def export_ciphertext(path, ciphertext, gate_params):
     tfhe_io.export_ciphertext(path, ciphertext, gate_params)
+
+
+# In-memory serialization. The exports return a memoryview of a buffer that
+# tfhe_io.so allocated, which is freed once every view of it is released.
+# The imports take anything that supports the buffer protocol, and only copy
+# it if it is neither bytes nor writable.
+
+def take_buffer(export, *arguments):
+    address = c_void_p()
+    size = export(byref(address), *arguments)
+    array = (c_char * size).from_address(address.value)
+    weakref.finalize(array, tfhe_io.free_buffer, address.value)
+    return memoryview(array).cast("B")
+
+
+def give_buffer(buffer):
+    if isinstance(buffer, bytes):
+        return buffer, len(buffer)
+    view = memoryview(buffer).cast("B")
+    if view.readonly:
+        return bytes(view), view.nbytes
+    return (c_char * view.nbytes).from_buffer(view), view.nbytes
+
+
+def export_gate_params_to_buffer(gate_params):
+    if PLAINTEXT:
+        return tfhe_io.export_gate_params_to_buffer(gate_params)
+    return take_buffer(tfhe_io.export_gate_params_to_buffer, gate_params)
+
+
+def import_gate_params_from_buffer(buffer):
+    if PLAINTEXT:
+        return tfhe_io.import_gate_params_from_buffer(buffer)
+    return tfhe_io.import_gate_params_from_buffer(*give_buffer(buffer))
+
+
+def export_secret_keyset_to_buffer(secret_keyset):
+    if PLAINTEXT:
+        return tfhe_io.export_secret_keyset_to_buffer(secret_keyset)
+    return take_buffer(tfhe_io.export_secret_keyset_to_buffer, secret_keyset)
+
+
+def import_secret_keyset_from_buffer(buffer):
+    if PLAINTEXT:
+        return tfhe_io.import_secret_keyset_from_buffer(buffer)
+    return tfhe_io.import_secret_keyset_from_buffer(*give_buffer(buffer))
+
+
+def export_cloud_keyset_to_buffer(cloud_keyset):
+    if PLAINTEXT:
+        return tfhe_io.export_cloud_keyset_to_buffer(cloud_keyset)
+    return take_buffer(tfhe_io.export_cloud_keyset_to_buffer, cloud_keyset)
+
+
+def import_cloud_keyset_from_buffer(buffer):
+    if PLAINTEXT:
+        return tfhe_io.import_cloud_keyset_from_buffer(buffer)
+    return tfhe_io.import_cloud_keyset_from_buffer(*give_buffer(buffer))
+
+
+def export_ciphertext_to_buffer(ciphertext, gate_params):
+    if PLAINTEXT:
+        return tfhe_io.export_ciphertext_to_buffer(ciphertext, gate_params)
+    return take_buffer(tfhe_io.export_ciphertext_to_buffer, ciphertext, gate_params)
+
+
+def import_ciphertext_from_buffer(buffer, ciphertext, gate_params):
+    if PLAINTEXT:
+        tfhe_io.import_ciphertext_from_buffer(buffer, ciphertext, gate_params)
+    else:
+        tfhe_io.import_ciphertext_from_buffer(*give_buffer(buffer), ciphertext, gate_params)
+
+
+# Run a netlist that was compiled into arrays of opcodes and operands (see
+# native.py) for a number of cycles with a single call into tfhe_io.so.
+# `wires` isn't changed, even though the registers are swapped between cycles.
+def run_netlist(wires, opcodes, operands, swaps, cycles, cloud_keyset):
+    if PLAINTEXT:
+        return tfhe_io.run_netlist(wires, opcodes, operands, swaps, cycles, cloud_keyset)
+    samples = (POINTER(LweSample) * len(wires))(*wires)
+    tfhe_io.run_netlist(samples, len(opcodes), (c_ubyte * len(opcodes)).from_buffer(opcodes),
+                        (c_int * len(operands)).from_buffer(operands), len(swaps) // 2,
+                        (c_int * len(swaps)).from_buffer(swaps), cycles, cloud_keyset)
@@ -1,4 +1,7 @@
+#define _GNU_SOURCE
 #include <stdio.h>
+#include <stdlib.h>
+#include <pthread.h>
 #include <tfhe/tfhe.h>
 #include <tfhe/tfhe_io.h>
 
@@ -65,3 +68,159 @@ void import_ciphertext(const char* filename, LweSample* sample, const TFheGateBo
     fclose(file);
 }
 
+
+
+/** Buffers
+ * The *_to_buffer functions write into a new buffer from malloc, store it
+ * in *buffer and return its size. It has to be released with free_buffer.
+ * The *_from_buffer functions read from size bytes at buffer. */
+
+void free_buffer(char* buffer) {
+    free(buffer);
+}
+
+size_t export_gate_params_to_buffer(char** buffer, const TFheGateBootstrappingParameterSet* params) {
+    size_t size;
+    FILE* file = open_memstream(buffer, &size);
+    export_tfheGateBootstrappingParameterSet_toFile(file, params);
+    fclose(file);
+    return size;
+}
+
+TFheGateBootstrappingParameterSet* import_gate_params_from_buffer(const char* buffer, size_t size) {
+    FILE* file = fmemopen((void*) buffer, size, "r");
+    TFheGateBootstrappingParameterSet* params = new_tfheGateBootstrappingParameterSet_fromFile(file);
+    fclose(file);
+    return params;
+}
+
+size_t export_secret_keyset_to_buffer(char** buffer, const TFheGateBootstrappingSecretKeySet* keyset) {
+    size_t size;
+    FILE* file = open_memstream(buffer, &size);
+    export_tfheGateBootstrappingSecretKeySet_toFile(file, keyset);
+    fclose(file);
+    return size;
+}
+
+TFheGateBootstrappingSecretKeySet* import_secret_keyset_from_buffer(const char* buffer, size_t size) {
+    FILE* file = fmemopen((void*) buffer, size, "r");
+    TFheGateBootstrappingSecretKeySet* keyset = new_tfheGateBootstrappingSecretKeySet_fromFile(file);
+    fclose(file);
+    return keyset;
+}
+
+size_t export_cloud_keyset_to_buffer(char** buffer, const TFheGateBootstrappingCloudKeySet* keyset) {
+    size_t size;
+    FILE* file = open_memstream(buffer, &size);
+    export_tfheGateBootstrappingCloudKeySet_toFile(file, keyset);
+    fclose(file);
+    return size;
+}
+
+TFheGateBootstrappingCloudKeySet* import_cloud_keyset_from_buffer(const char* buffer, size_t size) {
+    FILE* file = fmemopen((void*) buffer, size, "r");
+    TFheGateBootstrappingCloudKeySet* keyset = new_tfheGateBootstrappingCloudKeySet_fromFile(file);
+    fclose(file);
+    return keyset;
+}
+
+size_t export_ciphertext_to_buffer(char** buffer, const LweSample* sample, const TFheGateBootstrappingParameterSet* params) {
+    size_t size;
+    FILE* file = open_memstream(buffer, &size);
+    export_gate_bootstrapping_ciphertext_toFile(file, sample, params);
+    fclose(file);
+    return size;
+}
+
+void import_ciphertext_from_buffer(const char* buffer, size_t size, LweSample* sample, const TFheGateBootstrappingParameterSet* params) {
+    FILE* file = fmemopen((void*) buffer, size, "r");
+    import_gate_bootstrapping_ciphertext_fromFile(file, sample, params);
+    fclose(file);
+}
+
+
+/** Netlists
+ * run_netlist evaluates a netlist for a number of cycles without going
+ * back to Python. Gate i computes opcodes[i] into wires[operands[4 * i]]
+ * from the wires at the next three operands (or from the value in the
+ * first one, for CONSTANT). Between cycles, the wires at every pair in
+ * swaps are swapped, which is how registers carry a value to the next
+ * cycle. The opcodes are in the order of OPCODES in tfhe_utils.py. */
+
+enum { CONSTANT, NOT, COPY, NAND, OR, AND, XOR, XNOR, NOR, ANDNY, ANDYN, ORNY, ORYN, MUX };
+
+void run_netlist(LweSample** wires, int gates, const unsigned char* opcodes, const int* operands,
+                 int registers, const int* swaps, int cycles, const TFheGateBootstrappingCloudKeySet* bk) {
+    for (int cycle = 0; cycle < cycles; cycle++) {
+        if (cycle > 0) {
+            for (int i = 0; i < registers; i++) {
+                LweSample* state = wires[swaps[2 * i]];
+                wires[swaps[2 * i]] = wires[swaps[2 * i + 1]];
+                wires[swaps[2 * i + 1]] = state;
+            }
+        }
+        for (int i = 0; i < gates; i++) {
+            const int* o = operands + 4 * i;
+            switch (opcodes[i]) {
+                case CONSTANT: bootsCONSTANT(wires[o[0]], o[1], bk); break;
+                case NOT: bootsNOT(wires[o[0]], wires[o[1]], bk); break;
+                case COPY: bootsCOPY(wires[o[0]], wires[o[1]], bk); break;
+                case NAND: bootsNAND(wires[o[0]], wires[o[1]], wires[o[2]], bk); break;
+                case OR: bootsOR(wires[o[0]], wires[o[1]], wires[o[2]], bk); break;
+                case AND: bootsAND(wires[o[0]], wires[o[1]], wires[o[2]], bk); break;
+                case XOR: bootsXOR(wires[o[0]], wires[o[1]], wires[o[2]], bk); break;
+                case XNOR: bootsXNOR(wires[o[0]], wires[o[1]], wires[o[2]], bk); break;
+                case NOR: bootsNOR(wires[o[0]], wires[o[1]], wires[o[2]], bk); break;
+                case ANDNY: bootsANDNY(wires[o[0]], wires[o[1]], wires[o[2]], bk); break;
+                case ANDYN: bootsANDYN(wires[o[0]], wires[o[1]], wires[o[2]], bk); break;
+                case ORNY: bootsORNY(wires[o[0]], wires[o[1]], wires[o[2]], bk); break;
+                case ORYN: bootsORYN(wires[o[0]], wires[o[1]], wires[o[2]], bk); break;
+                case MUX: bootsMUX(wires[o[0]], wires[o[1]], wires[o[2]], wires[o[3]], bk); break;
+            }
+        }
+    }
+}
+
+
+/** Bulk encryption
+ * encrypt_bits encrypts messages[i] into samples[i] for every i < count,
+ * with one byte for every message.
+ * The random number generator of TFHE isn't thread safe, so it runs on
+ * one thread. decrypt_bits does the reverse, split across threads. */
+
+void encrypt_bits(LweSample** samples, const unsigned char* messages, int count, const TFheGateBootstrappingSecretKeySet* key) {
+    for (int i = 0; i < count; i++) {
+        bootsSymEncrypt(samples[i], messages[i], key);
+    }
+}
+
+typedef struct {
+    LweSample** samples;
+    unsigned char* messages;
+    int start;
+    int stop;
+    const TFheGateBootstrappingSecretKeySet* key;
+} DecryptJob;
+
+static void* decrypt_job(void* argument) {
+    DecryptJob* job = argument;
+    for (int i = job->start; i < job->stop; i++) {
+        job->messages[i] = bootsSymDecrypt(job->samples[i], job->key);
+    }
+    return NULL;
+}
+
+void decrypt_bits(LweSample** samples, unsigned char* messages, int count, int threads, const TFheGateBootstrappingSecretKeySet* key) {
+    if (threads < 1) threads = 1;
+    pthread_t handles[threads];
+    DecryptJob jobs[threads];
+    for (int t = 0; t < threads; t++) {
+        DecryptJob job = {samples, messages, (long) count * t / threads, (long) count * (t + 1) / threads, key};
+        jobs[t] = job;
+        if (t > 0) pthread_create(&handles[t], NULL, decrypt_job, &jobs[t]);
+    }
+    decrypt_job(&jobs[0]);
+    for (int t = 1; t < threads; t++) {
+        pthread_join(handles[t], NULL);
+    }
+}
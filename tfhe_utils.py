@@ -4,6 +4,12 @@ from ctypes import *
 dir_path = os.path.dirname(os.path.realpath(__file__))
 tfhe_io_path = dir_path + "/tfhe_io.so"
 
+# Pass this as the library to evaluate gates on plaintext bits instead (see plaintext.py)
+PLAINTEXT_LIBRARY = "plaintext"
+
+# The gates that run_netlist in tfhe_io.c knows, in the order of its opcodes
+OPCODES = ["CONSTANT", "NOT", "COPY", "NAND", "OR", "AND", "XOR", "XNOR", "NOR", "ANDNY", "ANDYN", "ORNY", "ORYN", "MUX"]
+
 
 Torus32 = c_int32
 
@@ -149,7 +155,11 @@ class TFheGateBootstrappingSecretKeySet(Structure):
                 ("cloud", TFheGateBootstrappingCloudKeySet)]
 
 
-def initialize(library, architecture):
+def initialize(library, architecture, lanes=1):
+    if library == PLAINTEXT_LIBRARY:
+        import plaintext
+        return plaintext.initialize(architecture, lanes)
+
     tfhe = cdll.LoadLibrary(library)
     tfhe_io = cdll.LoadLibrary(tfhe_io_path)
 
@@ -166,10 +176,10 @@ def initialize(library, architecture):
     tfhe.delete_gate_bootstrapping_ciphertext.argtypes = [POINTER(LweSample)]
     tfhe.delete_gate_bootstrapping_ciphertext.restype = None
 
-    # These are array operations that can't be typed unless you know the length ahead of time
+    # Ciphertext arrays are contiguous blocks of LweSamples
     tfhe.new_gate_bootstrapping_ciphertext_array.argtypes = [c_int, POINTER(TFheGateBootstrappingParameterSet)]
-    tfhe.new_gate_bootstrapping_ciphertext_array.restype = POINTER(LweSample) * architecture
-    tfhe.delete_gate_bootstrapping_ciphertext_array.argtypes = [c_int, POINTER(LweSample) * architecture]
+    tfhe.new_gate_bootstrapping_ciphertext_array.restype = POINTER(LweSample)
+    tfhe.delete_gate_bootstrapping_ciphertext_array.argtypes = [c_int, POINTER(LweSample)]
     tfhe.delete_gate_bootstrapping_ciphertext_array.restype = None
 
     tfhe_io.export_gate_params.argtypes = [c_char_p, POINTER(TFheGateBootstrappingParameterSet)]
@@ -189,4 +199,33 @@ def initialize(library, architecture):
     tfhe_io.export_ciphertext.restype = None
     tfhe_io.import_ciphertext.restype = None
 
+    tfhe_io.free_buffer.argtypes = [c_void_p]
+    tfhe_io.free_buffer.restype = None
+    tfhe_io.export_gate_params_to_buffer.argtypes = [POINTER(c_void_p), POINTER(TFheGateBootstrappingParameterSet)]
+    tfhe_io.import_gate_params_from_buffer.argtypes = [c_void_p, c_size_t]
+    tfhe_io.export_gate_params_to_buffer.restype = c_size_t
+    tfhe_io.import_gate_params_from_buffer.restype = POINTER(TFheGateBootstrappingParameterSet)
+    tfhe_io.export_secret_keyset_to_buffer.argtypes = [POINTER(c_void_p), POINTER(TFheGateBootstrappingSecretKeySet)]
+    tfhe_io.import_secret_keyset_from_buffer.argtypes = [c_void_p, c_size_t]
+    tfhe_io.export_secret_keyset_to_buffer.restype = c_size_t
+    tfhe_io.import_secret_keyset_from_buffer.restype = POINTER(TFheGateBootstrappingSecretKeySet)
+    tfhe_io.export_cloud_keyset_to_buffer.argtypes = [POINTER(c_void_p), POINTER(TFheGateBootstrappingCloudKeySet)]
+    tfhe_io.import_cloud_keyset_from_buffer.argtypes = [c_void_p, c_size_t]
+    tfhe_io.export_cloud_keyset_to_buffer.restype = c_size_t
+    tfhe_io.import_cloud_keyset_from_buffer.restype = POINTER(TFheGateBootstrappingCloudKeySet)
+    tfhe_io.export_ciphertext_to_buffer.argtypes = [POINTER(c_void_p), POINTER(LweSample), POINTER(TFheGateBootstrappingParameterSet)]
+    tfhe_io.import_ciphertext_from_buffer.argtypes = [c_void_p, c_size_t, POINTER(LweSample), POINTER(TFheGateBootstrappingParameterSet)]
+    tfhe_io.export_ciphertext_to_buffer.restype = c_size_t
+    tfhe_io.import_ciphertext_from_buffer.restype = None
+
+    tfhe_io.run_netlist.argtypes = [POINTER(POINTER(LweSample)), c_int, POINTER(c_ubyte), POINTER(c_int),
+                                    c_int, POINTER(c_int), c_int, POINTER(TFheGateBootstrappingCloudKeySet)]
+    tfhe_io.run_netlist.restype = None
+
+    # The samples are passed as the address of an array of their addresses
+    tfhe_io.encrypt_bits.argtypes = [c_void_p, c_char_p, c_int, POINTER(TFheGateBootstrappingSecretKeySet)]
+    tfhe_io.encrypt_bits.restype = None
+    tfhe_io.decrypt_bits.argtypes = [c_void_p, c_void_p, c_int, c_int, POINTER(TFheGateBootstrappingSecretKeySet)]
+    tfhe_io.decrypt_bits.restype = None
+
     return tfhe, tfhe_io